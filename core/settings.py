@@ -101,6 +101,38 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# Local memory by default (and in tests), Redis when REDIS_URL is set, e.g. redis://127.0.0.1:6379/1
+# Local memory is per process: the catalogue, auth user, permission and /customers/me/ caches below are only used with
+# a shared backend, see store.caching.shared_cache(). Set REDIS_URL when running several workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+if os.environ.get('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }
+
+STORE_CATALOGUE_CACHE_TIMEOUT = 60 * 15  # seconds a cached product page lives if nothing invalidates it
+STORE_AUTH_USER_CACHE_TIMEOUT = 60  # seconds an authenticated user is served from the cache
+STORE_PERMISSIONS_CACHE_TIMEOUT = 60 * 15  # seconds a user's permission set is served from the cache
+STORE_CUSTOMER_CACHE_TIMEOUT = 60 * 15  # seconds /customers/me/ is served from the cache
+STORE_IMAGE_WORKERS = 2  # threads resizing uploaded product images, see store/images.py
+STORE_IMAGE_VARIANTS_SYNC = False  # True resizes inline instead (tests, scripts)
+STORE_CART_RETENTION_DAYS = 30  # carts older than this are removed by `manage.py purge_abandoned_carts`
+STORE_EVENTS_BACKEND = 'thread'  # where order events are handled: 'thread', 'sync' (inline, tests) or 'celery', see store/events.py
+STORE_EVENTS_BATCH_SIZE = 100  # order events handled per transaction
+
+# Product search: 'auto' picks the full text backend for the database in use ('postgresql' tsvector / 'sqlite' FTS5),
+# 'icontains' keeps DRF's plain SearchFilter
+STORE_SEARCH_BACKEND = 'auto'
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -160,9 +192,22 @@ REST_FRAMEWORK = {
     'COERCE_DECIMAL_TO_STRING': False,
     # 'PAGE_SIZE': 10,
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # 'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'store.authentication.CachedJWTAuthentication',  # same tokens, the user row comes from the cache
     ),
-    'DEFAULT_PERMISSION_CLASSES':['rest_framework.permissions.IsAuthenticated'] 
+    'DEFAULT_PERMISSION_CLASSES':['rest_framework.permissions.IsAuthenticated'],
+    # orjson backed JSON (store/renderers.py), plain DRF JSON if orjson isn't installed
+    'DEFAULT_RENDERER_CLASSES': [
+        # 'rest_framework.renderers.JSONRenderer',
+        'store.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        # 'rest_framework.parsers.JSONParser',
+        'store.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 from datetime import timedelta
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from . models import *
+from . onboarding import create_missing_customers
 
 # Register your models here.
 
@@ -20,6 +21,13 @@ class UserAdmin(BaseUserAdmin):
             },
         ),
     )
+    actions = ['create_customers']
+
+    # users that came in through bulk_create never got a customer from the post_save signal
+    @admin.action(description='Create missing customers for selected users')
+    def create_customers(self, request, queryset):
+        created = create_missing_customers(queryset)
+        self.message_user(request, f'Created {created} customers.')
     # list_display = ['id', 'username', 'first_name', 'last_name']
 
 @admin.register(Category)
@@ -28,5 +36,15 @@ class CategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ['id','title', 'slug', 'price', 'description', 'junk', 'when_uploaded', 'last_updated', 'category']
+    list_display = ['id','title', 'slug', 'price', 'description', 'junk', 'when_uploaded', 'last_updated', 'category', 'stock', 'stock_shards']
+
+    def get_readonly_fields(self, request, obj=None):
+        # an existing product's stock moves with every order, restock with `manage.py stock <id> --add N`
+        return ['stock'] if obj else []
+
 
+@admin.register(OrderEvent)
+class OrderEventAdmin(admin.ModelAdmin):
+    list_display = ['id', 'order', 'event_type', 'created_at', 'processed_at', 'attempts']
+    list_filter = ['event_type', 'processed_at']
+    list_select_related = ['order']
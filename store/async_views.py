@@ -0,0 +1,112 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from rest_framework import exceptions
+from rest_framework.request import Request
+
+from .authentication import CachedJWTAuthentication
+from .models import Category, Product, Review
+from .pagination import ReviewPagination
+from .permissions import ahas_cached_perms
+from .readonly import ProductValuesSerializer
+from .renderers import ORJSONRenderer
+from .views import ProductViewSet
+
+
+# Async-native versions of the catalogue reads, for the ASGI deployment (core/asgi.py). The DRF views run in
+# a worker thread per request; these stay on the event loop and only leave it for the queries themselves
+# (aget / acount / async for over .values() rows). Same JWT auth, permissions, filters, pagination and JSON
+# as the DRF endpoints, mounted next to them under /store/async/. GET only: writes stay on the DRF views,
+# and the catalogue cache / conditional GET of the sync endpoints are not applied here.
+renderer = ORJSONRenderer()
+
+
+def json_response(data, status=200, headers=None):
+    return HttpResponse(renderer.render(data), status=status, content_type='application/json', headers=headers)
+
+
+def catalogue_view(permission=None):
+    # authentication, the permission check and DRF's error format around an async view
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method != 'GET':
+                return json_response({'detail': f'Method "{request.method}" not allowed.'}, status=405, headers={'Allow': 'GET'})
+            authenticator = CachedJWTAuthentication()
+            try:
+                auth = await authenticator.aauthenticate(request)
+                if auth is None:
+                    raise exceptions.NotAuthenticated()
+                request.user = auth[0]
+                if permission and not await ahas_cached_perms(request.user, [permission]):
+                    raise exceptions.PermissionDenied()
+                return await view(Request(request), *args, **kwargs)
+            except exceptions.APIException as exc:
+                headers = {}
+                if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+                    headers['WWW-Authenticate'] = authenticator.authenticate_header(request)
+                data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+                return json_response(data, status=exc.status_code, headers=headers)
+        return wrapper
+    return decorator
+
+
+def paginated_response(paginator, data):
+    response = paginator.get_paginated_response(data)
+    headers = {name: value for name, value in response.items() if name != 'Content-Type'}  # e.g. X-Approximate-Count
+    return json_response(response.data, headers=headers)
+
+
+async def product_data(request, pk, image_variant):
+    rows = ProductValuesSerializer.prepare(Product.objects.filter(pk=pk))
+    data = await ProductValuesSerializer(rows, many=True, context={'request': request, 'image_variant': image_variant}).adata()
+    if not data:
+        raise exceptions.NotFound()
+    return data[0]
+
+
+@catalogue_view('store.view_product')
+async def product_list(request):
+    # the filter backends and the paginator choice are ProductViewSet's own
+    view = ProductViewSet(request=request, action='list', format_kwarg=None, args=(), kwargs={})
+    if request.query_params.keys() & view.filterset_class.base_filters.keys():
+        # validating ?category_id= looks the category up, the filterset can only do that synchronously
+        queryset = await sync_to_async(view.filter_queryset)(view.get_queryset())
+    else:
+        queryset = view.filter_queryset(view.get_queryset())
+    queryset = ProductValuesSerializer.prepare(queryset)
+    paginator = view.paginator
+    page = await paginator.apaginate_queryset(queryset, request, view)
+    data = await ProductValuesSerializer(page, many=True, context={'request': request, 'image_variant': 'card'}).adata()
+    return paginated_response(paginator, data)
+
+
+@catalogue_view('store.view_product')
+async def product_detail(request, pk):
+    return json_response(await product_data(request, pk, 'full'))
+
+
+@catalogue_view()
+async def category_list(request):
+    # CategorySerializer's fields, product_count is a stored column
+    return json_response([category async for category in Category.objects.values('id', 'title', 'product_count')])
+
+
+@catalogue_view()
+async def review_list(request, product_pk):
+    # like ReviewViewSet the product is serialized once and embedded in every review
+    try:
+        product = await product_data(request, product_pk, 'card')
+    except exceptions.NotFound:
+        product = None  # an unknown product has no reviews: an empty page, not a 404
+    paginator = ReviewPagination()
+    queryset = Review.objects.filter(product_id=product_pk).values('id', 'posted_at', 'reviewer_name', 'remark')
+    page = await paginator.apaginate_queryset(queryset, request)
+    return paginated_response(paginator, [{
+        'id': review['id'],
+        'posted_at': review['posted_at'].isoformat(),
+        'reviewer_name': review['reviewer_name'],
+        'remark': review['remark'],
+        'product': product,
+    } for review in page])
@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .caching import shared_cache
+
+
+# What authenticating and the permission checks read from request.user. Only these are cached, never the password
+# hash or the rest of the profile; the user is rebuilt with every other field deferred, so code that does read one
+# loads it from the database, and a save() writes only what was loaded.
+CACHED_USER_FIELDS = ['id', 'username', 'is_active', 'is_staff', 'is_superuser']
+
+
+def user_cache_key(user_id):
+    return f'store:auth:user:{user_id}'
+
+
+def cached_user_values(user):
+    return {name: getattr(user, name) for name in CACHED_USER_FIELDS}
+
+
+def forget_user(user_id):
+    cache.delete(user_cache_key(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    # The token already names the user, so the user's CACHED_USER_FIELDS are kept in the cache for a short while
+    # instead of the row being read on every request. Saving or deleting a User (password change, deactivation...)
+    # drops the entry.
+    # Only with a shared cache backend (see shared_cache()), otherwise the user is read on every request as before.
+    cache_timeout = getattr(settings, 'STORE_AUTH_USER_CACHE_TIMEOUT', 60)
+
+    async def aauthenticate(self, request):
+        # authenticate() for the async views: the token checks don't touch the database, the user is read with aget()
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        key = user_cache_key(user_id)
+        use_cache = shared_cache()
+        values = await cache.aget(key) if use_cache else None
+        if values is None:
+            try:
+                user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed('User not found', code='user_not_found')
+            if not user.is_active:
+                raise AuthenticationFailed('User is inactive', code='user_inactive')
+            if use_cache:
+                await cache.aset(key, cached_user_values(user), self.cache_timeout)
+            return user
+        return self.cached_user(values)
+
+    def cached_user(self, values):
+        # from_db() takes the loaded values in the model's field order, the missing ones are deferred
+        names = [field.attname for field in self.user_model._meta.concrete_fields if field.attname in values]
+        user = self.user_model.from_db(self.user_model.objects.db, names, [values[name] for name in names])
+        if not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return user
+
+    def get_user(self, validated_token):
+        if not shared_cache():
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        key = user_cache_key(user_id)
+        values = cache.get(key)
+        if values is None:
+            user = super().get_user(validated_token)  # raises for unknown and inactive users, those are never cached
+            cache.set(key, cached_user_values(user), self.cache_timeout)
+            return user
+        return self.cached_user(values)
@@ -0,0 +1,33 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+# Thread pools for the work the web process does off the request thread (image variants, order events).
+# One pool per name, created on first use. Every job runs between close_old_connections() calls, like a request,
+# so the pool threads don't hold on to stale or broken database connections, and a failing job is logged
+# instead of being left in a Future nobody reads.
+_executors = {}
+_lock = threading.Lock()
+
+
+def submit(name, max_workers, function, *args, **kwargs):
+    with _lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = _executors[name] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'store-{name}')
+    return executor.submit(_run, name, function, args, kwargs)
+
+
+def _run(name, function, args, kwargs):
+    close_old_connections()
+    try:
+        return function(*args, **kwargs)
+    except Exception:
+        logger.exception('Background job %s (%s) failed', name, getattr(function, '__name__', function))
+    finally:
+        close_old_connections()
@@ -0,0 +1,131 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+
+# Read-through cache for the catalogue (product list & detail).
+# Every key carries the current catalogue version, so invalidating is a single incr instead of
+# hunting down every cached page; stale entries just expire. Only used with a shared cache, see shared_cache().
+VERSION_KEY = 'store:catalogue:version'
+HITS_KEY = 'store:catalogue:hits'
+MISSES_KEY = 'store:catalogue:misses'
+
+
+def cache_version(key):
+    version = cache.get(key)
+    if version is None:
+        # time based, so a version evicted from the cache never comes back as an old number
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def acache_version(key):
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def bump_cache_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+
+
+def catalogue_version():
+    return cache_version(VERSION_KEY)
+
+
+def invalidate_catalogue():
+    bump_cache_version(VERSION_KEY)
+
+
+def shared_cache():
+    # The catalogue pages and the per-user caches (auth users, permission sets, /customers/me/) are dropped by signals
+    # in whichever worker made the change. With LocMemCache every process has its own copy and the others would go on
+    # serving an old price, a revoked permission or a deactivated user until the entry expires, so those caches are
+    # only used with a shared backend (Redis, memcached, database...).
+    return not isinstance(caches['default'], LocMemCache)  # `cache` is a proxy, the instance is caches['default']
+
+
+# The customer behind /customers/me/, per user. Dropped by the Customer save/delete signals.
+def customer_cache_key(user_id):
+    return f'store:customer:{user_id}'
+
+
+def forget_customer(user_id):
+    cache.delete(customer_cache_key(user_id))
+
+
+def _count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout=None)
+
+
+def catalogue_cache_stats():
+    return {
+        'hits': cache.get(HITS_KEY, 0),
+        'misses': cache.get(MISSES_KEY, 0),
+        'version': cache.get(VERSION_KEY),
+    }
+
+
+class CatalogueCacheMixin:
+    # Caches the data of list/retrieve responses. Only the query params named by the view's filterset,
+    # search, ordering and pagination take part in the key, in sorted order, so ?a=1&b=2 and ?b=2&a=1 share an entry.
+    cache_timeout = getattr(settings, 'STORE_CATALOGUE_CACHE_TIMEOUT', 60 * 15)
+    cache_query_params = []  # any other query params the view reads
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_cache_query_params(self):
+        params = {api_settings.SEARCH_PARAM, api_settings.ORDERING_PARAM, *self.cache_query_params}
+        if getattr(self, 'filterset_class', None):
+            params.update(self.filterset_class.base_filters)
+        if self.paginator is not None:
+            params.update(
+                getattr(self.paginator, name) for name in ['page_query_param', 'page_size_query_param', 'cursor_query_param', 'approximate_count_query_param']
+                if getattr(self.paginator, name, None)
+            )
+        return params
+
+    def get_cache_key(self, request):
+        wanted = self.get_cache_query_params()
+        query = urlencode(sorted(
+            (name, value) for name, values in request.query_params.lists() if name in wanted for value in values
+        ))
+        # the host is part of the key because image urls in the response are absolute
+        raw = f'{self.basename}:{self.action}:{request.get_host()}:{sorted(self.kwargs.items())}:{query}'
+        return f'store:catalogue:{catalogue_version()}:{hashlib.md5(raw.encode()).hexdigest()}'
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not shared_cache():  # other workers would never see this one's version bumps
+            return handler(request, *args, **kwargs)
+        key = self.get_cache_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            _count(HITS_KEY)
+            data, headers = cached
+            return Response(data, headers=headers)
+        _count(MISSES_KEY)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            # headers set by the view or paginator (e.g. X-Approximate-Count) are replayed, the renderer sets Content-Type
+            headers = {name: value for name, value in response.items() if name != 'Content-Type'}
+            cache.set(key, (response.data, headers), self.cache_timeout)
+        return response
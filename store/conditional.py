@@ -0,0 +1,82 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.response import Response
+
+from .caching import shared_cache
+
+
+# Conditional GET for read endpoints. The validators come from one aggregate over the rows a response would show:
+# the latest `last_updated` and, for the ETag, the row count as well so deletions change it too.
+# Nothing is serialized for that, so If-None-Match / If-Modified-Since revalidations are answered with a bare 304.
+# Last-Modified (and so If-Modified-Since) is only used on detail views: deleting a row from a list doesn't move
+# the latest timestamp, a list would be reported unmodified. Lists are revalidated with their ETag.
+class ConditionalGetMixin:
+    last_modified_fields = ['last_updated']  # every timestamp the response depends on, e.g. a parent's
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def get_validator_queryset(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.detail_view():
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return queryset.order_by()
+
+    def detail_view(self):
+        # viewsets know their action, plain generic views only their url kwargs
+        action = getattr(self, 'action', None)
+        if action is not None:
+            return action == 'retrieve'
+        return (self.lookup_url_kwarg or self.lookup_field) in self.kwargs
+
+    def get_validators(self, request):
+        aggregates = {f'last_{i}': Max(field) for i, field in enumerate(self.last_modified_fields)}
+        values = self.get_validator_queryset().aggregate(count=Count('pk'), **aggregates)
+        if self.detail_view() and not values['count']:
+            return None, None  # the view answers 404 itself
+        timestamps = [values[name] for name in aggregates if values[name] is not None]
+        last_modified = max(timestamps) if timestamps and self.detail_view() else None
+        # the representation also depends on the url (filters, page), the host (absolute urls) and the renderer
+        raw = ':'.join([
+            type(self).__name__, request.get_full_path(), request.get_host(), request.accepted_media_type,
+            str(values['count']), *(value.isoformat() for value in timestamps),
+        ])
+        return f'W/"{hashlib.md5(raw.encode()).hexdigest()}"', last_modified
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        if etag is None:
+            return handler(request, *args, **kwargs)
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        precondition = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if precondition is not None:
+            response = Response(status=precondition.status_code)  # 304, or 412 for a failed If-Match
+        else:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        return response
+
+
+class CatalogueConditionalGetMixin(ConditionalGetMixin):
+    # For views behind CatalogueCacheMixin (store/caching.py). On a shared cache its key already names the catalogue
+    # version, which every product, image or category change bumps, and the host, url kwargs and query params the
+    # response depends on; the ETag is made from it without a query, so 304s, cache hits and keyset pages don't pay
+    # for an aggregate over the whole filtered set. No Last-Modified: the version isn't a time.
+    # A per-process cache only sees this worker's bumps, so there the validators come from the database as above.
+    def get_validators(self, request):
+        if not shared_cache():
+            return super().get_validators(request)
+        raw = f'{self.get_cache_key(request)}:{request.accepted_media_type}'
+        return f'W/"{hashlib.md5(raw.encode()).hexdigest()}"', None
@@ -0,0 +1,130 @@
+import logging
+import threading
+import traceback
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+
+from . import background
+from .models import ORDER_EVENT_MAX_ATTEMPTS, OrderEvent
+
+try:
+    from celery import shared_task
+except ImportError:  # optional, only needed with STORE_EVENTS_BACKEND = 'celery'
+    shared_task = None
+
+logger = logging.getLogger(__name__)
+
+
+# Order event outbox. Checkout only inserts an OrderEvent row in its own transaction (publish()); the side effects
+# registered with @on_event run afterwards, in batches, when drain_order_events is run. Where it runs is
+# STORE_EVENTS_BACKEND:
+#   'thread'  a background thread of the web process, nudged when the checkout transaction commits (default)
+#   'sync'    inline right after the commit (tests, scripts)
+#   'celery'  a Celery task, for projects running Celery workers
+# `manage.py process_order_events` drains the outbox from its own process as well, and picks up events whose nudge
+# was lost to a restart. Delivery is at least once: a handler may see an event again, so it should be idempotent.
+MAX_ATTEMPTS = ORDER_EVENT_MAX_ATTEMPTS
+HANDLERS = {}
+
+_lock = threading.Lock()
+_queued = set()
+
+
+def on_event(event_type):
+    # @on_event(OrderEvent.ORDER_PLACED) def send_confirmation(event): ...
+    def register(handler):
+        HANDLERS.setdefault(event_type, []).append(handler)
+        return handler
+    return register
+
+
+class Task:
+    # The part of Celery's task API used here (task(), .delay(), .apply_async()), so the outbox can move to
+    # Celery by changing a setting.
+    def __init__(self, run, name):
+        self.run = run
+        self.name = name
+        self.celery_task = shared_task(name=name)(run) if shared_task else None
+
+    def __call__(self, *args, **kwargs):
+        return self.run(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        return self.apply_async(args, kwargs)
+
+    def apply_async(self, args=(), kwargs=None, **options):
+        kwargs = kwargs or {}
+        backend = getattr(settings, 'STORE_EVENTS_BACKEND', 'thread')
+        if backend == 'celery':
+            if self.celery_task is None:
+                raise ImproperlyConfigured("STORE_EVENTS_BACKEND = 'celery' needs celery installed")
+            return self.celery_task.apply_async(args, kwargs, **options)
+        if backend == 'sync':
+            return self.run(*args, **kwargs)
+
+        with _lock:
+            if self.name in _queued:
+                return None  # a run that hasn't started yet will see whatever this one would have
+            _queued.add(self.name)
+        return background.submit('events', 1, self._work, args, kwargs)
+
+    def _work(self, args, kwargs):
+        with _lock:
+            _queued.discard(self.name)
+        return self.run(*args, **kwargs)
+
+
+def task(name):
+    return lambda run: Task(run, name)
+
+
+def publish(order, event_type, payload=None):
+    # call inside the transaction that changes the order: the event exists if and only if the change does
+    event = OrderEvent.objects.create(order=order, event_type=event_type, payload=payload or {})
+    transaction.on_commit(drain_order_events.delay)
+    return event
+
+
+def process_batch(batch_size=100):
+    # One transaction per batch. skip_locked lets several workers drain side by side on PostgreSQL;
+    # SQLite has no row locks, run a single worker there. Returns how many events were handled.
+    with transaction.atomic():
+        events = list(
+            OrderEvent.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True, attempts__lt=MAX_ATTEMPTS)
+            .order_by('id')[:batch_size]
+        )
+        for event in events:
+            event.attempts += 1
+            try:
+                with transaction.atomic():  # a failing handler's writes are undone, the rest of the batch goes on
+                    for handler in HANDLERS.get(event.event_type, []):
+                        handler(event)
+            except Exception:
+                logger.exception('Order event %s (%s) failed', event.pk, event.event_type)
+                event.last_error = traceback.format_exc()
+            else:
+                event.processed_at = timezone.now()
+                event.last_error = ''
+        OrderEvent.objects.bulk_update(events, ['processed_at', 'attempts', 'last_error'])
+    return len(events)
+
+
+@task('store.drain_order_events')
+def drain_order_events(batch_size=None):
+    batch_size = batch_size or getattr(settings, 'STORE_EVENTS_BATCH_SIZE', 100)
+    total = 0
+    while True:
+        handled = process_batch(batch_size)
+        total += handled
+        if handled < batch_size:
+            return total
+
+
+@on_event(OrderEvent.ORDER_PLACED)
+def log_order_placed(event):
+    logger.info('Order %s placed by customer %s: %s items, total %s',
+                event.order_id, event.payload.get('customer_id'), len(event.payload.get('items', [])), event.payload.get('total'))
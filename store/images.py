@@ -0,0 +1,118 @@
+import logging
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db.models.functions import Now
+from PIL import Image
+
+from . import background
+from .caching import invalidate_catalogue
+from .models import Product, ProductImage
+
+logger = logging.getLogger(__name__)
+
+
+# Resized copies of every product image, each in the upload's own format and as WebP.
+# They are made off the request thread and stored next to the original under store/image/variants/;
+# ProductImage.variants maps variant -> format -> storage name once they exist.
+VARIANTS = {
+    'thumbnail': (150, 150),
+    'card': (400, 400),  # product lists
+    'full': (1200, 1200),  # product detail
+}
+VARIANT_DIR = 'variants'
+
+
+def variant_name(name, variant, extension):
+    folder, filename = os.path.split(name)
+    return os.path.join(folder, VARIANT_DIR, f'{os.path.splitext(filename)[0]}_{variant}.{extension}')
+
+
+def _encode(image, format):
+    if format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, format=format, **({'quality': 80, 'method': 4} if format == 'WEBP' else {'optimize': True}))
+    return buffer.getvalue()
+
+
+def make_variants(image_file):
+    # {variant: {extension: bytes}}, never upscaled: a variant bigger than the upload is the upload re-encoded
+    with Image.open(image_file) as original:
+        original.load()
+    format = original.format or 'PNG'
+    extension = 'jpeg' if format == 'JPEG' else format.lower()
+    variants = {}
+    for variant, size in VARIANTS.items():
+        resized = original.copy()
+        resized.thumbnail(size)
+        variants[variant] = {extension: _encode(resized, format), 'webp': _encode(resized, 'WEBP')}
+    return variants
+
+
+def generate_variants(image_id):
+    product_image = ProductImage.objects.filter(pk=image_id).first()
+    if product_image is None or not product_image.image:
+        return {}
+    storage = product_image.image.storage
+    with product_image.image.open('rb') as image_file:
+        encoded = make_variants(image_file)
+
+    delete_variants(product_image)
+    names = {}
+    for variant, encodings in encoded.items():
+        names[variant] = {}
+        for extension, content in encodings.items():
+            names[variant][extension] = storage.save(variant_name(product_image.image.name, variant, extension), ContentFile(content))
+
+    # update() rather than save(): the image itself didn't change, so the save signals (and another run) don't fire
+    updated = ProductImage.objects.filter(pk=image_id, image=product_image.image.name).update(variants=names)
+    if not updated:
+        # replaced or deleted while we were busy, whoever did that has scheduled their own run
+        _delete_names(storage, names)
+        return {}
+    Product.objects.filter(pk=product_image.product_id).update(last_updated=Now())  # new ETag for the product pages
+    invalidate_catalogue()  # cached product pages still point at the originals
+    return names
+
+
+def delete_variants(product_image):
+    _delete_names(product_image.image.storage, product_image.variants or {})
+
+
+def _delete_names(storage, variants):
+    for encodings in variants.values():
+        for name in encodings.values():
+            storage.delete(name)
+
+
+def _generate(image_id):
+    try:
+        generate_variants(image_id)
+    except Exception:
+        # a broken upload keeps its empty variants, the API goes on serving the original
+        logger.exception('Could not generate variants for ProductImage %s', image_id)
+
+
+def schedule_variants(image_id):
+    # STORE_IMAGE_VARIANTS_SYNC = True runs the work inline (management commands, tests)
+    if getattr(settings, 'STORE_IMAGE_VARIANTS_SYNC', False):
+        return _generate(image_id)
+    return background.submit('images', getattr(settings, 'STORE_IMAGE_WORKERS', 2), _generate, image_id)
+
+
+def variant_storage_name(variants, variant, extension=None):
+    # storage name of a variant (in the upload's format unless `extension` says otherwise), None while it hasn't been made yet
+    encodings = (variants or {}).get(variant)
+    if not encodings:
+        return None
+    if extension is None:
+        extension = next(name for name in encodings if name != 'webp')
+    return encodings.get(extension)
+
+
+def variant_url(product_image, variant, extension=None):
+    name = variant_storage_name(product_image.variants, variant, extension)
+    return product_image.image.storage.url(name) if name else None
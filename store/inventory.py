@@ -0,0 +1,101 @@
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import Product, StockShard
+
+
+# Stock is taken with conditional decrements (UPDATE ... SET stock = stock - q WHERE stock >= q) inside the checkout
+# transaction: the check and the write are one statement, so two checkouts can never both sell the last unit, and
+# nothing is read first and written later. Products with stock = NULL aren't tracked and always sell.
+# Hot products can have their stock split over StockShard rows (shard_stock()); a checkout takes from one random
+# free shard, so concurrent orders for the product hold different row locks instead of queueing on the same one.
+class OutOfStock(Exception):
+    def __init__(self, lines):
+        super().__init__('Not enough stock')
+        self.lines = lines  # (product_id, quantity) of the cart
+
+
+def reserve_stock(lines):
+    # lines: (product_id, quantity, stock, stock_shards) for every cart line, stock and stock_shards as read with the
+    # cart (they only tell tracked/sharded products apart, the amounts are checked by the updates).
+    # Must run inside the checkout transaction; raises OutOfStock, which rolls it back.
+    requested = [(product_id, quantity) for product_id, quantity, _, _ in lines]
+    tracked = sorted((product_id, quantity) for product_id, quantity, stock, shards in lines if not shards and stock is not None)
+    if tracked:
+        # every tracked line in one statement; the rows are locked in id order first so carts sharing products don't deadlock
+        quantity = Case(*[When(pk=product_id, then=Value(amount)) for product_id, amount in tracked], output_field=PositiveIntegerField())
+        locked = Product.objects.filter(pk__in=[product_id for product_id, _ in tracked]).order_by('pk').select_for_update().values('pk')
+        updated = Product.objects.filter(pk__in=Subquery(locked), stock__gte=quantity).update(stock=F('stock') - quantity)
+        if updated != len(tracked):
+            raise OutOfStock(requested)
+
+    # then the sharded lines, in product order so two carts never wait on each other's shards crosswise
+    for product_id, amount, _, shards in sorted(lines):
+        if shards and not take_from_shards(product_id, amount):
+            raise OutOfStock(requested)
+
+
+def take_from_shards(product_id, quantity):
+    # One random shard that can cover the whole line and that no other checkout holds right now. SKIP LOCKED never
+    # waits, so this can't join a lock cycle; a plain UPDATE that waits and then finds the shard too low keeps its
+    # row lock anyway (READ COMMITTED), and trying shards that way in random order deadlocks once stock runs low.
+    shard = StockShard.objects.select_for_update(skip_locked=True).filter(product_id=product_id, stock__gte=quantity).order_by('?').values_list('pk', flat=True).first()
+    if shard is not None:
+        StockShard.objects.filter(pk=shard).update(stock=F('stock') - quantity)
+        return True
+
+    # all busy or none big enough: wait for every shard, locked in shard order, and take the line from as many as it needs
+    rows = list(StockShard.objects.select_for_update().filter(product_id=product_id).order_by('shard').values_list('pk', 'stock'))
+    if sum(stock for _, stock in rows) < quantity:
+        return False
+    taken = {}
+    for pk, stock in rows:
+        if stock:
+            taken[pk] = min(stock, quantity)
+            quantity -= taken[pk]
+        if not quantity:
+            break
+    amount = Case(*[When(pk=pk, then=Value(units)) for pk, units in taken.items()], output_field=PositiveIntegerField())
+    StockShard.objects.filter(pk__in=taken).update(stock=F('stock') - amount)
+    return True
+
+
+def available_stock(product_ids):
+    # {product_id: units left, None when not tracked}
+    rows = Product.objects.filter(pk__in=product_ids).annotate(sharded=Coalesce(Sum('shards__stock'), 0)).values_list('pk', 'stock', 'stock_shards', 'sharded')
+    return {pk: sharded if shards else stock for pk, stock, shards, sharded in rows}
+
+
+def shortages(lines):
+    # (product_id, units left) of the lines that can't be filled right now
+    available = available_stock([product_id for product_id, _ in lines])
+    return [(product_id, available[product_id]) for product_id, quantity in lines
+            if available.get(product_id) is not None and available[product_id] < quantity]
+
+
+def shard_stock(product_id, shards):
+    # Spreads a product's stock evenly over `shards` rows, or back into Product.stock with shards=0.
+    with transaction.atomic():
+        product = Product.objects.select_for_update().get(pk=product_id)
+        total = available_stock([product_id])[product_id]
+        if total is None:
+            raise ValueError(f'Stock is not tracked for product {product_id}')
+        StockShard.objects.filter(product_id=product_id).delete()
+        base, extra = divmod(total, shards) if shards else (0, 0)
+        StockShard.objects.bulk_create(
+            StockShard(product_id=product_id, shard=shard, stock=base + (shard < extra)) for shard in range(shards)
+        )
+        Product.objects.filter(pk=product.pk).update(stock=None if shards else total, stock_shards=shards)
+
+
+def add_stock(product_id, units):
+    # restocking; on a sharded product the units are spread like shard_stock() does
+    with transaction.atomic():
+        product = Product.objects.select_for_update().get(pk=product_id)
+        if not product.stock_shards:
+            Product.objects.filter(pk=product_id).update(stock=Coalesce(F('stock'), 0) + units)
+            return
+        base, extra = divmod(units, product.stock_shards)
+        for shard in range(product.stock_shards):
+            StockShard.objects.filter(product_id=product_id, shard=shard).update(stock=F('stock') + base + int(shard < extra))
@@ -0,0 +1,129 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from statistics import quantiles
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from store.models import User
+
+
+class Command(BaseCommand):
+    help = ('Load tests the DRF catalogue reads (/store/...) against their async versions (/store/async/..., see '
+            'store/async_views.py) under uvicorn: N keep-alive connections each send GETs back to back for --duration '
+            'seconds. Reads whatever is in the database, run it with DEBUG off (query logging) and against a copy.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', required=True, help='requests are authenticated with a JWT for this user')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[100, 500, 1_000])
+        parser.add_argument('--paths', nargs='+', default=['products/', 'category/'], help='relative to /store/ and /store/async/')
+        parser.add_argument('--duration', type=float, default=10)
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--external', action='store_true', help='use a server already listening on --host/--port instead of starting uvicorn')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['username']).first()
+        if user is None:
+            raise CommandError(f'No user {options["username"]!r}')
+        token = f'{api_settings.AUTH_HEADER_TYPES[0]} {AccessToken.for_user(user)}'
+        host, port = options['host'], options['port']
+
+        server = None if options['external'] else self.start_server(host, port)
+        try:
+            for concurrency in options['concurrency']:
+                for path in options['paths']:
+                    for prefix in ['/store/', '/store/async/']:
+                        stats = asyncio.run(self.load(host, port, prefix + path, token, concurrency, options['duration']))
+                        self.stdout.write(
+                            f'{concurrency:>5} conn  {prefix + path:<34} {stats["rps"]:8.1f} req/s  '
+                            f'p50 {stats["p50"]:8.1f} ms  p99 {stats["p99"]:8.1f} ms  {stats["errors"]} errors'
+                        )
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    def start_server(self, host, port):
+        try:
+            import uvicorn  # noqa: F401
+        except ImportError:
+            raise CommandError('uvicorn is not installed (pip install uvicorn), or pass --external')
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+        except OSError:
+            pass
+        else:
+            raise CommandError(f'Something is already listening on {host}:{port}, pick another --port or pass --external')
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'core.asgi:application', '--host', host, '--port', str(port),
+             '--log-level', 'warning', '--no-access-log', '--backlog', '4096'],
+            cwd=settings.BASE_DIR, env={**os.environ, 'PYTHONPATH': os.pathsep.join(sys.path)},
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection((host, port), timeout=1).close()
+                return server
+            except OSError:
+                if server.poll() is not None:
+                    raise CommandError('uvicorn exited on startup')
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError(f'uvicorn is not answering on {host}:{port}')
+
+    async def load(self, host, port, path, token, concurrency, duration):
+        request = f'GET {path} HTTP/1.1\r\nHost: {host}\r\nAuthorization: {token}\r\n\r\n'.encode()
+        latencies, errors = [], 0
+        deadline = perf_counter() + duration
+
+        async def connection():
+            nonlocal errors
+            reader, writer = await asyncio.open_connection(host, port)
+            try:
+                while perf_counter() < deadline:
+                    start = perf_counter()
+                    writer.write(request)
+                    status = await asyncio.wait_for(read_response(reader), timeout=60)
+                    latencies.append(perf_counter() - start)
+                    if status != 200:
+                        errors += 1
+            finally:
+                writer.close()
+
+        started = perf_counter()
+        results = await asyncio.gather(*[connection() for _ in range(concurrency)], return_exceptions=True)
+        elapsed = perf_counter() - started
+        errors += sum(isinstance(result, Exception) for result in results)  # refused / reset / timed out connections
+
+        percentiles = quantiles(latencies, n=100) if len(latencies) > 1 else [0] * 99
+        return {
+            'rps': len(latencies) / elapsed,
+            'p50': percentiles[49] * 1000,
+            'p99': percentiles[98] * 1000,
+            'errors': errors,
+        }
+
+
+async def read_response(reader):
+    # just enough HTTP/1.1 for uvicorn's keep-alive responses: Content-Length or chunked bodies
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = dict(line.lower().split(': ', 1) for line in lines[1:] if ': ' in line)
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    return status
@@ -0,0 +1,45 @@
+from statistics import median
+from time import perf_counter
+from uuid import uuid4
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from store.models import Cart, CartItem, Category, Product, User
+from store.serializers import CreateOrderSerializer
+
+
+class Command(BaseCommand):
+    help = 'Times checkout (CreateOrderSerializer) for carts of different sizes. Everything it creates is rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1, 50, 500])
+        parser.add_argument('--runs', type=int, default=5)
+
+    def handle(self, *args, **options):
+        sizes, runs = options['sizes'], options['runs']
+        with transaction.atomic():
+            user = User.objects.create_user(username=f'bench-{uuid4().hex[:8]}', email=f'{uuid4().hex}@bench.local')
+            category = Category.objects.create(title='bench')
+            products = Product.objects.bulk_create(
+                Product(title=f'bench {i}', price=5000 + i, description='bench', category=category) for i in range(max(sizes))
+            )
+
+            for size in sizes:
+                timings, queries = [], 0
+                for _ in range(runs):
+                    cart = Cart.objects.create()
+                    CartItem.objects.bulk_create(CartItem(cart=cart, product=product, quantity=1) for product in products[:size])
+
+                    start = perf_counter()
+                    with CaptureQueriesContext(connection) as ctx:
+                        serializer = CreateOrderSerializer(data={'cart_id': cart.id}, context={'user_id': user.id})
+                        serializer.is_valid(raise_exception=True)
+                        serializer.save()
+                    timings.append(perf_counter() - start)
+                    queries = len(ctx.captured_queries)
+
+                self.stdout.write(f'{size:>6} items  median {median(timings) * 1000:8.2f} ms  {queries} queries')
+
+            transaction.set_rollback(True)
@@ -0,0 +1,108 @@
+import threading
+from statistics import median
+from time import perf_counter
+from uuid import uuid4
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+from django.db.models import Sum
+from rest_framework.exceptions import ValidationError
+
+from store.inventory import available_stock, shard_stock
+from store.models import Cart, CartItem, Category, Customer, Order, OrderItem, Product, User
+from store.onboarding import build_user, bulk_onboard
+from store.serializers import CreateOrderSerializer
+
+
+class Command(BaseCommand):
+    help = ('Load test for stock reservation: --checkouts customers check out the same product at the same moment, one '
+            'thread (and database connection) each, with less stock than demand. Checks nothing is oversold and reports '
+            'throughput, with the stock in Product.stock and sharded. Commits real rows and deletes them afterwards; '
+            'meant for PostgreSQL (SQLite lets one writer in at a time) with max_connections above --checkouts.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checkouts', type=int, default=200)
+        parser.add_argument('--stock', type=int, default=150)
+        parser.add_argument('--quantity', type=int, default=1, help='Units in each cart.')
+        parser.add_argument('--shards', type=int, nargs='+', default=[0, 8], help='0 = unsharded.')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite':
+            self.stderr.write('SQLite serializes writers, expect "database is locked" errors rather than contention numbers.')
+        tag = uuid4().hex[:8]
+        category = Category.objects.create(title=f'bench-inventory-{tag}')
+        product = Product.objects.create(title=f'bench-inventory-{tag}', description='bench', price=5000, category=category)
+        users = bulk_onboard([build_user(f'bench-{tag}-{i}', f'bench-{tag}-{i}@bench.local') for i in range(options['checkouts'])])
+        try:
+            for shards in options['shards']:
+                self.run(product, users, shards, options)
+        finally:
+            orders = Order.objects.filter(customer__user__in=users)
+            OrderItem.objects.filter(order__in=orders).delete()
+            orders.delete()
+            Cart.objects.filter(cartitem__product=product).delete()
+            product.delete()
+            category.delete()
+            Customer.objects.filter(user__in=users).delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+    def run(self, product, users, shards, options):
+        quantity, stock = options['quantity'], options['stock']
+        Product.objects.filter(pk=product.pk).update(stock=stock, stock_shards=0)
+        shard_stock(product.pk, shards)
+        carts = Cart.objects.bulk_create(Cart() for _ in users)
+        CartItem.objects.bulk_create(CartItem(cart=cart, product=product, quantity=quantity) for cart in carts)
+
+        barrier = threading.Barrier(len(users) + 1)
+        results = []  # (outcome, seconds)
+
+        def checkout(cart, user):
+            try:
+                barrier.wait()
+                start = perf_counter()
+                try:
+                    serializer = CreateOrderSerializer(data={'cart_id': cart.id}, context={'user_id': user.pk})
+                    serializer.is_valid(raise_exception=True)
+                    serializer.save()
+                    outcome = 'ordered'
+                except ValidationError:
+                    outcome = 'out of stock'
+                except DatabaseError as exc:
+                    outcome = f'error: {str(exc).splitlines()[0]}'
+                results.append((outcome, perf_counter() - start))
+            finally:
+                connection.close()  # each thread has its own connection
+
+        threads = [threading.Thread(target=checkout, args=(cart, user)) for cart, user in zip(carts, users)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        start = perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = perf_counter() - start
+
+        ordered = [seconds for outcome, seconds in results if outcome == 'ordered']
+        refused = sum(outcome == 'out of stock' for outcome, _ in results)
+        errors = sorted({outcome for outcome, _ in results if outcome.startswith('error')})
+        left = available_stock([product.pk])[product.pk]
+        sold = OrderItem.objects.filter(product=product, order__customer__user__in=users).aggregate(units=Sum('quantity'))['units'] or 0
+        expected = min(len(users), stock // quantity)
+        oversold = sold + left != stock  # every unit is either in an order or still on the shelf
+
+        self.stdout.write(
+            f'shards {shards:>2}  {len(results)} checkouts  {len(ordered)} ordered (expected {expected})  '
+            f'{refused} out of stock  {len(results) - len(ordered) - refused} errors  '
+            f'sold {sold} + left {left} = {sold + left} of {stock}  {"OVERSOLD" if oversold else "no oversell"}  '
+            f'{elapsed:.2f} s  {len(ordered) / elapsed:.1f} orders/s  median {median(ordered) * 1000 if ordered else 0:.1f} ms'
+        )
+        for error in errors:
+            self.stdout.write(f'  {error}')
+        if oversold:
+            raise CommandError('Stock and orders disagree')
+
+        # fresh orders and carts for the next round
+        orders = Order.objects.filter(customer__user__in=users)
+        OrderItem.objects.filter(order__in=orders).delete()
+        orders.delete()
+        Cart.objects.filter(cartitem__product=product).delete()
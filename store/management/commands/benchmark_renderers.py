@@ -0,0 +1,47 @@
+import json
+from statistics import median
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from store.models import Category, Product
+from store.querysets import optimize_queryset
+from store.renderers import ORJSONRenderer, orjson
+from store.serializers import ProductSerializer
+
+
+class Command(BaseCommand):
+    help = 'Times rendering one page of serialized products with DRF\'s JSONRenderer and the orjson renderer. Everything it creates is rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1_000)
+        parser.add_argument('--runs', type=int, default=50)
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            raise CommandError('orjson is not installed, ORJSONRenderer would only be timing JSONRenderer')
+        with transaction.atomic():
+            category = Category.objects.create(title='bench')
+            Product.objects.bulk_create(
+                Product(title=f'Product {i} – “quoted” ünïcode', description='description ' * 20, price=5000 + i % 4000 + 0.99, category=category)
+                for i in range(options['products'])
+            )
+            products = optimize_queryset(Product.objects.filter(category=category), ProductSerializer)
+            # the shape the paginated list endpoint hands to the renderer, Decimal prices and product_tax included
+            data = {'count': len(products), 'next': None, 'previous': None, 'results': ProductSerializer(products, many=True).data}
+            transaction.set_rollback(True)
+
+        outputs = {}
+        for name, renderer in [('JSONRenderer', JSONRenderer()), ('ORJSONRenderer', ORJSONRenderer())]:
+            timings = []
+            for _ in range(options['runs']):
+                start = perf_counter()
+                outputs[name] = renderer.render(data, 'application/json')
+                timings.append(perf_counter() - start)
+            self.stdout.write(f'{name:>15}  median {median(timings) * 1000:8.3f} ms  {len(outputs[name]):,} bytes')
+
+        if json.loads(outputs['JSONRenderer']) != json.loads(outputs['ORJSONRenderer']):
+            raise CommandError('The two renderers produced different documents')
+        self.stdout.write(self.style.SUCCESS('Both renderers produce the same document'))
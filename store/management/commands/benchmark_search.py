@@ -0,0 +1,66 @@
+import random
+from statistics import median
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from rest_framework.filters import SearchFilter
+from rest_framework.request import Request
+
+from store.models import Category, Product
+from store.search import ProductSearchFilter, search_backend
+from store.views import ProductViewSet
+
+WORDS = [
+    'red', 'blue', 'green', 'black', 'white', 'leather', 'cotton', 'wool', 'denim', 'silk',
+    'shoe', 'boot', 'hat', 'shirt', 'jacket', 'scarf', 'sock', 'bag', 'belt', 'watch',
+    'classic', 'slim', 'vintage', 'sport', 'summer', 'winter', 'waterproof', 'handmade', 'organic', 'premium',
+]
+# a long tail of made-up words so descriptions look more like real text than 30 words on repeat
+FILLER = [a + b + c for a in ['ka', 'lo', 'mi', 'ne', 'su', 'ta', 'vo', 'ri', 'pe', 'zu'] for b in 'bdfgklmnprst' for c in ['an', 'el', 'or', 'is', 'um']]
+
+
+class Command(BaseCommand):
+    help = 'Times product search (plain icontains vs the full text backend) on a synthetic catalogue. Everything it creates is rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1_000_000)
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--terms', nargs='+', default=['leather', 'red shoe', 'waterproof winter boot'])
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'full text backend: {search_backend(connection)}')
+        with transaction.atomic():
+            self.seed(options['products'])
+
+            view = ProductViewSet()
+            for term in options['terms']:
+                request = Request(RequestFactory().get('/', {'search': term}))
+                for name, backend in [('icontains', SearchFilter()), ('fulltext', ProductSearchFilter())]:
+                    timings = []
+                    for _ in range(options['runs']):
+                        start = perf_counter()
+                        queryset = backend.filter_queryset(request, Product.objects.all(), view)
+                        count = queryset.count()
+                        list(queryset[:5])  # what a ProductPagination page costs: COUNT + the first page
+                        timings.append(perf_counter() - start)
+                    self.stdout.write(f'{term!r:>28} {name:>10}  median {median(timings) * 1000:9.2f} ms  {count} matches')
+
+            transaction.set_rollback(True)
+
+    def seed(self, total, batch_size=10_000):
+        rng = random.Random(42)
+        category = Category.objects.create(title='bench')
+        for start in range(0, total, batch_size):
+            Product.objects.bulk_create(
+                Product(
+                    title=' '.join(rng.sample(WORDS, 3)),
+                    description=' '.join(rng.choices(WORDS, k=2) + rng.choices(FILLER, k=10)),
+                    price=rng.randint(1, 9999),
+                    category=category,
+                ) for _ in range(min(batch_size, total - start))
+            )
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE store_product')  # fresh statistics, or the planner won't trust the GIN index
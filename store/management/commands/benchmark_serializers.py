@@ -0,0 +1,65 @@
+import random
+from statistics import median
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from store.models import Category, Customer, Order, OrderItem, Product, ProductImage, User
+from store.querysets import optimize_queryset
+from store.readonly import OrderValuesSerializer, ProductValuesSerializer
+from store.serializers import OrderSerializer, ProductSerializer
+
+
+class Command(BaseCommand):
+    help = ('Times the product and order list serializers (ModelSerializer over optimized querysets) against the '
+            '.values() based read-only ones, queries included. Everything it creates is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[100, 1_000, 10_000])
+        parser.add_argument('--runs', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            largest = max(options['rows'])
+            self.seed(largest)
+            products = Product.objects.filter(title__startswith='bench ').order_by('id')
+            orders = Order.objects.filter(customer__user__username='bench').order_by('id')
+            context = {'image_variant': 'card'}
+
+            for rows in options['rows']:
+                cases = [
+                    ('products', 'ProductSerializer', lambda: ProductSerializer(optimize_queryset(products, ProductSerializer)[:rows], many=True, context=context).data),
+                    ('products', 'ProductValuesSerializer', lambda: ProductValuesSerializer(ProductValuesSerializer.prepare(products)[:rows], many=True, context=context).data),
+                    ('orders', 'OrderSerializer', lambda: OrderSerializer(optimize_queryset(orders, OrderSerializer)[:rows], many=True).data),
+                    ('orders', 'OrderValuesSerializer', lambda: OrderValuesSerializer(OrderValuesSerializer.prepare(orders)[:rows], many=True).data),
+                ]
+                for kind, name, serialize in cases:
+                    timings = []
+                    for _ in range(options['runs']):
+                        start = perf_counter()
+                        serialize()
+                        timings.append(perf_counter() - start)
+                    self.stdout.write(f'{rows:>7} {kind:<9} {name:>24}  median {median(timings) * 1000:9.2f} ms')
+
+            transaction.set_rollback(True)
+
+    def seed(self, total, batch_size=5_000):
+        rng = random.Random(42)
+        category = Category.objects.create(title='bench')
+        products = []
+        for start in range(0, total, batch_size):
+            products += Product.objects.bulk_create(
+                Product(title=f'bench {i}', description='benchmark product', price=rng.randint(500_000, 999_999) / 100, category=category)
+                for i in range(start, min(start + batch_size, total))
+            )
+        ProductImage.objects.bulk_create(ProductImage(product=product, image='store/image/bench.png') for product in products[::2])
+
+        user = User.objects.create_user('bench', 'bench@example.com', 'bench')
+        customer = Customer.objects.get(user=user)
+        orders = Order.objects.bulk_create(Order(customer=customer) for _ in range(total))
+        for start in range(0, total, batch_size):
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, product=product, price=product.price, quantity=rng.randint(1, 5))
+                for order in orders[start:start + batch_size] for product in rng.sample(products, 3)
+            )
@@ -0,0 +1,120 @@
+import itertools
+import json
+import random
+import re
+from base64 import urlsafe_b64encode
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from rest_framework.request import Request
+
+from store.models import Category, Product
+from store.pagination import ProductCursorPagination, ProductPagination
+from store.views import ProductViewSet
+
+# "Seq Scan on store_product" (PostgreSQL) or "SCAN store_product" without an index (SQLite)
+SEQUENTIAL_SCAN = re.compile(r'Seq Scan on store_product\b|\bSCAN store_product\b(?! USING)')
+# An index scan whose bound doesn't match the query reads rows only to throw them away (PostgreSQL EXPLAIN ANALYZE)
+ROWS_REMOVED = re.compile(r'Rows Removed by Filter: (\d+)')
+
+
+class Command(BaseCommand):
+    help = ('Seeds a product catalogue (rolled back afterwards), runs EXPLAIN on the queries ProductViewSet makes for every '
+            'ProductFilter / ordering combination, first and deep cursor pages included, and fails if any of them scans '
+            'the whole product table or (PostgreSQL) filters out more than --max-rows-removed rows an index returned.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=20_000)
+        parser.add_argument('--categories', type=int, default=50)
+        # A price range ordered by when_uploaded rightly filters about page_size / selectivity rows out of the
+        # when_uploaded index; a keyset bound that isn't an index condition filters out every row before the cursor.
+        parser.add_argument('--max-rows-removed', type=int, help='Default: a tenth of --products.')
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every plan, not only the failing ones.')
+
+    def handle(self, *args, **options):
+        failures = []
+        max_rows_removed = options['max_rows_removed'] or options['products'] // 10
+        with transaction.atomic():
+            category_id, low_price, high_price = self.seed(options['products'], options['categories'])
+
+            # selective values, so an index is the right plan and a sequential scan is a real regression
+            filters = [{}, {'category_id': category_id}, {'price__gt': high_price}, {'price__lt': low_price},
+                       {'category_id': category_id, 'price__gt': high_price}, {'category_id': category_id, 'price__lt': low_price}]
+            orderings = [None] + [prefix + field for field in ProductViewSet.ordering_fields for prefix in ['', '-']]
+
+            for params, ordering in itertools.product(filters, orderings):
+                if ordering:
+                    params = {**params, 'ordering': ordering}
+                queryset = self.product_queryset(params)
+                queries = []
+                if ordering:
+                    # an unordered page may rightly be a scan that stops after page_size rows, so only ordered pages are checked
+                    queries.append(('page', queryset[:ProductPagination.page_size]))
+                    # a cursor deep into the result: the keyset bound must be an index condition, not a filter
+                    deep_page = self.deep_page_queryset(params, queryset)
+                    if deep_page is not None:
+                        queries.append(('deep page', deep_page))
+                if set(params) - {'ordering'}:
+                    queries.append(('count', queryset.order_by()))  # the paginator's COUNT(*) over the filtered set
+
+                for kind, query in queries:
+                    plan = query.explain(analyze=True) if connection.vendor == 'postgresql' else query.explain()
+                    problems = self.problems(plan, max_rows_removed)
+                    label = f'{kind:>9} {params}'
+                    if problems:
+                        failures.append(label)
+                    if problems or options['verbose_plans']:
+                        self.stdout.write(f'{", ".join(problems) or "ok":>8}  {label}\n{plan}\n')
+                    else:
+                        self.stdout.write(f'{"ok":>8}  {label}')
+
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError(f'{len(failures)} product queries fall back to a sequential scan or a filtered index scan')
+        self.stdout.write(self.style.SUCCESS('Every product filter/ordering combination uses an index'))
+
+    def problems(self, plan, max_rows_removed):
+        problems = []
+        if SEQUENTIAL_SCAN.search(plan):
+            problems.append('SEQ SCAN')
+        removed = max(map(int, ROWS_REMOVED.findall(plan)), default=0)
+        if removed > max_rows_removed:
+            problems.append(f'FILTERED {removed}')
+        return problems
+
+    def product_queryset(self, params):
+        # the same queryset the list endpoint builds, filters and ordering included
+        request = Request(RequestFactory().get('/store/products/', params))
+        view = ProductViewSet(request=request, action='list', format_kwarg=None, args=(), kwargs={})
+        return view.filter_queryset(view.get_queryset())
+
+    def deep_page_queryset(self, params, queryset):
+        # the page ProductCursorPagination reads for a cursor nine tenths of the way through the filtered rows
+        paginator = ProductCursorPagination()
+        fields = paginator.get_ordering(None, queryset, None)
+        rows = queryset.order_by(*fields)
+        count = rows.count()
+        if not count:
+            return None
+        last = rows[count * 9 // 10]
+        position = [paginator.cursor_value(last, field.lstrip('-')) for field in fields]
+        cursor = urlsafe_b64encode(json.dumps(position).encode('ascii')).decode('ascii')
+        request = Request(RequestFactory().get('/store/products/', {**params, 'cursor': cursor}))
+        return paginator.page_queryset(queryset, request)
+
+    def seed(self, total, categories, batch_size=10_000):
+        rng = random.Random(42)
+        category_ids = [category.id for category in Category.objects.bulk_create(
+            Category(title=f'explain {i}') for i in range(categories)
+        )]
+        for start in range(0, total, batch_size):
+            Product.objects.bulk_create(
+                Product(title=f'explain {i}', description='explain', price=rng.randint(100, 999_999) / 100, category_id=rng.choice(category_ids))
+                for i in range(start, min(start + batch_size, total))
+            )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE store_product' if connection.vendor == 'postgresql' else 'ANALYZE')
+        prices = sorted(Product.objects.filter(category_id__in=category_ids).values_list('price', flat=True))
+        return category_ids[0], prices[len(prices) // 100], prices[-len(prices) // 100]
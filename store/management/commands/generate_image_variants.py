@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from store.images import generate_variants
+from store.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = 'Makes the resized / WebP variants of product images inline, e.g. for images uploaded before the image workers existed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Regenerate every image, not only the ones without variants.')
+
+    def handle(self, *args, **options):
+        images = ProductImage.objects.order_by('pk')
+        if not options['all']:
+            images = images.filter(variants={})
+        done = failed = 0
+        for image_id in images.values_list('pk', flat=True).iterator():
+            try:
+                generate_variants(image_id)
+                done += 1
+            except Exception as error:
+                failed += 1
+                self.stderr.write(f'ProductImage {image_id}: {error}')
+        self.stdout.write(self.style.SUCCESS(f'Generated variants for {done} images') + (f', {failed} failed' if failed else ''))
@@ -0,0 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.events import drain_order_events
+
+
+class Command(BaseCommand):
+    help = ('Worker for the order event outbox (store/events.py): handles unprocessed events in batches, then polls for '
+            'new ones every --interval seconds. Run several on PostgreSQL if one can\'t keep up; one on SQLite.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'STORE_EVENTS_BATCH_SIZE', 100))
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to wait when the outbox is empty.')
+        parser.add_argument('--once', action='store_true', help='Drain what is there now and exit (cron).')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                handled = drain_order_events(batch_size=options['batch_size'])  # called directly, not through the backend
+                if handled:
+                    self.stdout.write(f'Handled {handled} order events')
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
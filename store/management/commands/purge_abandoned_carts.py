@@ -0,0 +1,52 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store.models import Cart, CartItem
+
+
+class Command(BaseCommand):
+    help = ('Deletes carts (and their items) created more than --days ago, in small batches with a pause in between so the '
+            'live cart tables are never locked for long. Meant to run from cron or any scheduler, e.g. nightly.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=getattr(settings, 'STORE_CART_RETENTION_DAYS', 30))
+        parser.add_argument('--batch-size', type=int, default=1_000)
+        parser.add_argument('--sleep', type=float, default=0.1, help='Seconds to wait between batches.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the carts that would be deleted.')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        abandoned = Cart.objects.filter(placed_at__lt=cutoff)  # walks the placed_at index
+        if options['dry_run']:
+            self.stdout.write(f'{abandoned.count()} carts older than {options["days"]} days')
+            return
+
+        carts = items = 0
+        while True:
+            ids = list(abandoned.order_by('placed_at').values_list('pk', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            # the items first, then carts that no longer have any. A batch of carts can hold any number of
+            # items, so they go in --batch-size chunks of their own, each DELETE a short statement.
+            items += self.delete_items(ids, options)
+            carts += Cart.objects.filter(pk__in=ids).delete()[1].get(Cart._meta.label, 0)
+            if len(ids) < options['batch_size']:
+                break
+            time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f'Deleted {carts} carts and {items} cart items older than {options["days"]} days'))
+
+    def delete_items(self, cart_ids, options):
+        deleted = 0
+        while True:
+            item_ids = list(CartItem.objects.filter(cart_id__in=cart_ids).order_by('pk').values_list('pk', flat=True)[:options['batch_size']])
+            if not item_ids:
+                return deleted
+            deleted += CartItem.objects.filter(pk__in=item_ids).delete()[0]
+            if len(item_ids) < options['batch_size']:
+                return deleted
+            time.sleep(options['sleep'])
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Now
+
+from store.models import Category, Product
+
+
+def counted_products():
+    # the real number of products in each category, as a correlated subquery
+    return Coalesce(Subquery(
+        Product.objects.filter(category=OuterRef('pk')).order_by().values('category').annotate(total=Count('id')).values('total')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the stored Category.product_count from the product table (or only reports drift with --check).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Only report categories whose count is wrong, exit with an error if any are.')
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            updated = Category.objects.update(product_count=counted_products(), last_updated=Now())
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt product_count for {updated} categories'))
+            return
+
+        drifted = Category.objects.annotate(actual=counted_products()).exclude(product_count=F('actual'))
+        for category in drifted:
+            self.stdout.write(f'{category.pk} {category.title}: stored {category.product_count}, actual {category.actual}')
+        if drifted:
+            raise CommandError('product_count is out of date, run `manage.py rebuild_product_counts`')
+        self.stdout.write(self.style.SUCCESS('product_count is up to date'))
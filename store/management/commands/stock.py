@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.inventory import add_stock, available_stock, shard_stock
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = ('Shows, restocks (--add) or shards (--shards) a product\'s stock, see store/inventory.py. Sharding splits a hot '
+            'product\'s stock over N rows so concurrent checkouts don\'t all wait on one row lock; --shards 0 undoes it.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_id', type=int)
+        parser.add_argument('--add', type=int, help='Units to add; starts tracking the stock of an untracked product.')
+        parser.add_argument('--shards', type=int)
+
+    def handle(self, *args, **options):
+        product_id = options['product_id']
+        try:
+            if options['add']:
+                add_stock(product_id, options['add'])
+            if options['shards'] is not None:
+                shard_stock(product_id, options['shards'])
+        except Product.DoesNotExist:
+            raise CommandError(f'No product {product_id}')
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        stock = available_stock([product_id]).get(product_id)
+        shards = Product.objects.filter(pk=product_id).values_list('stock_shards', flat=True).first()
+        if shards is None:
+            raise CommandError(f'No product {product_id}')
+        self.stdout.write(f'Product {product_id}: ' + ('stock not tracked' if stock is None else f'{stock} units') + (f' over {shards} shards' if shards else ''))
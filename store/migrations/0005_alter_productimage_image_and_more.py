@@ -0,0 +1,24 @@
+# Generated by Django 4.1.3 on 2026-10-18 19:30
+
+import django.core.validators
+from django.db import migrations, models
+import store.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0004_alter_productimage_image'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(default='prodefault.jpg', upload_to='store/image', validators=[store.validators.validate_file_size, django.core.validators.FileExtensionValidator(allowed_extensions=['png', 'jpeg'])]),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', '-posted_at', '-id'], name='store_revie_product_24518f_idx'),
+        ),
+    ]
@@ -0,0 +1,90 @@
+# Generated by Django 4.1.3 on 2026-10-18 19:36
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# The full text search objects as they were when this migration was written. A copy, not an import of
+# store/search.py, so later changes there don't change what this migration did.
+POSTGRES_INSTALL = [
+    """
+    CREATE OR REPLACE FUNCTION store_product_search_document() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_document :=
+            setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(NEW.description, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS store_product_search_document ON store_product",
+    """
+    CREATE TRIGGER store_product_search_document BEFORE INSERT OR UPDATE OF title, description, search_document
+    ON store_product FOR EACH ROW EXECUTE PROCEDURE store_product_search_document()
+    """,
+    "UPDATE store_product SET title = title",
+    "CREATE INDEX IF NOT EXISTS store_product_search_document_gin ON store_product USING gin (search_document)",
+]
+
+POSTGRES_UNINSTALL = [
+    "DROP INDEX IF EXISTS store_product_search_document_gin",
+    "DROP TRIGGER IF EXISTS store_product_search_document ON store_product",
+    "DROP FUNCTION IF EXISTS store_product_search_document()",
+]
+
+SQLITE_INSTALL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS store_product_fts USING fts5(title, description, content='store_product', content_rowid='id')",
+    """
+    CREATE TRIGGER IF NOT EXISTS store_product_fts_insert AFTER INSERT ON store_product BEGIN
+        INSERT INTO store_product_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS store_product_fts_delete AFTER DELETE ON store_product BEGIN
+        INSERT INTO store_product_fts(store_product_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS store_product_fts_update AFTER UPDATE ON store_product BEGIN
+        INSERT INTO store_product_fts(store_product_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO store_product_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """,
+    "INSERT INTO store_product_fts(store_product_fts) VALUES ('rebuild')",
+]
+
+SQLITE_UNINSTALL = [
+    "DROP TRIGGER IF EXISTS store_product_fts_insert",
+    "DROP TRIGGER IF EXISTS store_product_fts_delete",
+    "DROP TRIGGER IF EXISTS store_product_fts_update",
+    "DROP TABLE IF EXISTS store_product_fts",
+]
+
+
+def run(schema_editor, statements):
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def install(apps, schema_editor):
+    run(schema_editor, {'postgresql': POSTGRES_INSTALL, 'sqlite': SQLITE_INSTALL})
+
+
+def uninstall(apps, schema_editor):
+    run(schema_editor, {'postgresql': POSTGRES_UNINSTALL, 'sqlite': SQLITE_UNINSTALL})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_category_product_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_document',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(install, uninstall),
+    ]
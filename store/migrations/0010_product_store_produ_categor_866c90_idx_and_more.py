@@ -0,0 +1,21 @@
+# Generated by Django 4.1.3 on 2026-10-18 19:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_product_store_produ_price_aba1d8_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'price', 'id'], name='store_produ_categor_866c90_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'when_uploaded', 'id'], name='store_produ_categor_451e8f_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.1.3 on 2026-10-18 19:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_productimage_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='last_updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='last_updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.3 on 2026-10-18 20:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_category_last_updated_review_last_updated'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['placed_at'], name='store_cart_placed__b0453d_idx'),
+        ),
+    ]
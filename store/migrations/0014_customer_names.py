@@ -0,0 +1,43 @@
+# Generated by Django 4.1.3 on 2026-10-18 20:03
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_user_names(apps, schema_editor):
+    Customer = apps.get_model('store', 'Customer')
+    User = apps.get_model('store', 'User')
+    users = User.objects.filter(pk=OuterRef('user_id'))
+    Customer.objects.filter(user__isnull=False).update(
+        first_name=Subquery(users.values('first_name')[:1]),
+        last_name=Subquery(users.values('last_name')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_cart_placed_at_index'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='customer',
+            options={'ordering': ['first_name', 'last_name', 'id']},
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='first_name',
+            field=models.CharField(blank=True, editable=False, max_length=150),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='last_name',
+            field=models.CharField(blank=True, editable=False, max_length=150),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['first_name', 'last_name', 'id'], name='store_custo_first_n_794e2a_idx'),
+        ),
+        migrations.RunPython(copy_user_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.3 on 2026-10-18 20:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_inventory'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-placed_at', '-id'], name='store_order_placed__e37042_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.1.3 on 2026-10-18 21:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0017_order_staff_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='orderevent',
+            name='store_orderevent_pending',
+        ),
+        migrations.AddIndex(
+            model_name='orderevent',
+            index=models.Index(condition=models.Q(('attempts__lt', 5), ('processed_at__isnull', True)), fields=['id'], name='store_orderevent_pending'),
+        ),
+    ]
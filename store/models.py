@@ -1,6 +1,7 @@
 from django.db import models
 from django.core.validators import MinValueValidator, FileExtensionValidator
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.search import SearchVectorField
 from uuid import uuid4
 from . validators import validate_file_size
 
@@ -27,9 +28,16 @@ class Customer(models.Model):
     mobile = models.CharField(max_length=30)
     birth_date = models.DateField(null=True)
     membership = models.CharField(max_length=50, choices=MEMBERSHIP_OPTIONS, default=Silver)
+    # Copies of the user's names, kept in sync by the User post_save signal, so customers sort without joining store_user
+    first_name = models.CharField(max_length=150, blank=True, editable=False)
+    last_name = models.CharField(max_length=150, blank=True, editable=False)
 
     class Meta:
-        ordering = ['user__first_name', 'user__last_name']
+        # ordering = ['user__first_name', 'user__last_name']
+        ordering = ['first_name', 'last_name', 'id']
+        indexes = [
+            models.Index(fields=['first_name', 'last_name', 'id']),  # This backs the ordering and the customer list's keyset pagination
+        ]
 
     def __str__(self):
         return f'{self.user}'
@@ -53,6 +61,8 @@ class Address(models.Model):
 
 class Category(models.Model):
     title = models.CharField(max_length=200)
+    product_count = models.PositiveIntegerField(default=0, editable=False)  # Kept up to date by the product signals, rebuild with `manage.py rebuild_product_counts`
+    last_updated = models.DateTimeField(auto_now=True)  # Also moved by the product_count updates, it backs Last-Modified/ETag
 
     def __str__(self):
         return self.title
@@ -73,15 +83,74 @@ class Product(models.Model):
     last_updated = models.DateTimeField(auto_now=True)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     promotions = models.ManyToManyField(Promotion)
+    search_document = SearchVectorField(null=True, editable=False)  # Filled in by a database trigger on PostgreSQL, see store/search.py
+    stock = models.PositiveIntegerField(null=True, blank=True)  # units left; empty means stock isn't tracked for the product
+    stock_shards = models.PositiveSmallIntegerField(default=0, editable=False)  # > 0: the stock is split over StockShard rows, see store/inventory.py
+
+    class Meta:
+        indexes = [
+            # These back the keyset pagination for ?ordering=price / when_uploaded (id breaks ties)
+            models.Index(fields=['price', 'id']),
+            models.Index(fields=['when_uploaded', 'id']),
+            # ProductFilter's ?category_id= together with a price range and/or an ordering
+            models.Index(fields=['category', 'price', 'id']),
+            models.Index(fields=['category', 'when_uploaded', 'id']),
+        ]
 
     def __str__(self):
         # return f'{self.title} - {self.category.title}'
         return self.title
 
+    STOCK_FIELDS = ('stock', 'stock_shards')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_stock = instance._stock_values()
+        instance._loaded_category_id = instance.__dict__.get('category_id')  # for Category.product_count, see store/signals.py
+        return instance
+
+    def _stock_values(self):
+        return {name: self.__dict__[name] for name in self.STOCK_FIELDS if name in self.__dict__}  # __dict__ so a deferred field isn't fetched
+
+    def save(self, *args, **kwargs):
+        # Stock only moves through the conditional UPDATEs in store/inventory.py. Saving a product that was loaded
+        # earlier (admin, API edits) leaves the stock columns out of its UPDATE, so it can't write an old count back
+        # over orders; and a stock change made on the instance would be lost that way, so it is refused rather than dropped.
+        self._save_without_stock = not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert')
+        if self._save_without_stock:
+            current = self._stock_values()
+            if any(current.get(name) != value for name, value in getattr(self, '_loaded_stock', {}).items()):
+                raise ValueError('Product.save() does not write stock: use store.inventory.add_stock() / shard_stock() '
+                                 'or pass update_fields')
+        try:
+            super().save(*args, **kwargs)
+        finally:
+            self._save_without_stock = False
+        self._loaded_stock = self._stock_values()
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        # Only the UPDATE drops the stock columns. Django still narrows a save to the loaded fields (no query per
+        # deferred field) and still INSERTs, stock included, when the row turns out to be gone.
+        if getattr(self, '_save_without_stock', False):
+            values = [value for value in values if value[0].name not in self.STOCK_FIELDS]
+        return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+
+class StockShard(models.Model):
+    # A slice of a hot product's stock. Checkouts take from a random shard, so concurrent orders of the same
+    # product lock different rows instead of queueing on one.
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='shards')
+    shard = models.PositiveSmallIntegerField()
+    stock = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [['product', 'shard']]
+
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='image')
     image = models.ImageField(upload_to='store/image', default='prodefault.jpg', validators = 
     [validate_file_size, FileExtensionValidator(allowed_extensions=['png', 'jpeg'])])
+    variants = models.JSONField(default=dict, blank=True, editable=False)  # Resized/WebP copies made in the background, see store/images.py
 
 
 class Order(models.Model):
@@ -102,6 +171,12 @@ class Order(models.Model):
     payment_status = models.CharField(max_length=50, default='pending', choices= PAYMENT_STATUS)
     delivery_status = models.CharField(max_length=50, default='pending', choices= DELIVERY_STATUS)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', '-placed_at', '-id']),  # A customer's order history, newest first
+            models.Index(fields=['-placed_at', '-id']),  # Every order, newest first, for staff
+        ]
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.PROTECT)
@@ -110,6 +185,34 @@ class OrderItem(models.Model):
     price = models.DecimalField(max_digits=12, decimal_places=2)
 
 
+# failing order events are retried on later drains, then left with their last_error for a person to look at
+ORDER_EVENT_MAX_ATTEMPTS = 5
+
+
+class OrderEvent(models.Model):
+    # Outbox of things that happened to orders, written in the same transaction as the change itself.
+    # The side effects (emails, analytics, payments...) run later, see store/events.py.
+    ORDER_PLACED = 'order.placed'
+    EVENT_TYPES = [
+        (ORDER_PLACED, 'Order placed'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='events')
+    event_type = models.CharField(max_length=50, choices=EVENT_TYPES)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # the worker's "oldest unprocessed events" scan; processed and given up rows drop out of the index
+            models.Index(fields=['id'], name='store_orderevent_pending',
+                         condition=models.Q(processed_at__isnull=True, attempts__lt=ORDER_EVENT_MAX_ATTEMPTS)),
+        ]
+
+
 # class Cart(models.Model):
 #     placed_at = models.DateTimeField(auto_now_add=False)
 
@@ -118,6 +221,11 @@ class Cart(models.Model):
     id = models.UUIDField(default=uuid4, primary_key=True)  # This is for the a unique id for the products added to the cart. This is to prevent your cart from external sources (other users).
     placed_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['placed_at']),  # This lets `manage.py purge_abandoned_carts` find old carts without a scan
+        ]
+
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE)
@@ -134,6 +242,12 @@ class Review(models.Model):
     reviewer_name = models.CharField(max_length=250)
     remark = models.TextField()
     posted_at = models.DateField(auto_now_add=True)
+    last_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', '-posted_at', '-id']),  # This backs the keyset pagination of a product's reviews
+        ]
 
     def __str__(self):
         return f'Review for {self.product.title}'
@@ -0,0 +1,45 @@
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from .models import Customer, User
+
+
+# Creating users together with their Customer rows. bulk_create() skips post_save, so create_customer_for_user
+# never sees these users: their customers are inserted here, in batches, inside the caller's single transaction.
+def build_user(username, email, password=None, first_name='', last_name='', password_hash=None, **extra):
+    # what UserManager.create_user() would save; password_hash takes an already hashed password (e.g. from another system)
+    user = User(
+        username=User.normalize_username(username), email=User.objects.normalize_email(email),
+        first_name=first_name, last_name=last_name, **extra
+    )
+    if password_hash:
+        user.password = password_hash
+    else:
+        user.password = make_password(password)  # None gives an unusable password, the user sets one via password reset
+    return user
+
+
+def bulk_onboard(users, batch_size=5_000):
+    # users: unsaved User instances. Returns them with their pks set.
+    created = []
+    with transaction.atomic():
+        for start in range(0, len(users), batch_size):
+            batch = User.objects.bulk_create(users[start:start + batch_size])
+            if any(user.pk is None for user in batch):
+                # databases that can't return ids from a bulk insert
+                ids = dict(User.objects.filter(username__in=[user.username for user in batch]).values_list('username', 'pk'))
+                for user in batch:
+                    user.pk = ids[user.username]
+            Customer.objects.bulk_create(Customer(user_id=user.pk, first_name=user.first_name, last_name=user.last_name) for user in batch)
+            created += batch
+    return created
+
+
+def create_missing_customers(users, batch_size=5_000):
+    # for users that came in some other way without a customer, e.g. an old bulk_create
+    missing = list(users.filter(customer__isnull=True).values_list('pk', 'first_name', 'last_name'))
+    with transaction.atomic():
+        Customer.objects.bulk_create(
+            (Customer(user_id=pk, first_name=first_name, last_name=last_name) for pk, first_name, last_name in missing), batch_size=batch_size
+        )
+    return len(missing)
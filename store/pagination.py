@@ -1,8 +1,236 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db import connections
+from django.db.models import BooleanField, F, Func, Q, Value
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class DefaultPagination(PageNumberPagination):
     page_size = 10
 
-class ProductPagination(PageNumberPagination):
-    page_size = 5
\ No newline at end of file
+class AsyncPageNumberPagination(PageNumberPagination):
+    # apaginate_queryset() is paginate_queryset() for the async views (store/async_views.py):
+    # the count and the page rows are read with the async ORM, everything else is PageNumberPagination's.
+    async def apaginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        paginator.count = await queryset.acount()  # Paginator.count is a cached_property, this is its value
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            msg = self.invalid_page_message.format(page_number=page_number, message=str(exc))
+            raise NotFound(msg)
+        self.page.object_list = [row async for row in self.page.object_list]
+
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        self.request = request
+        return self.page.object_list
+
+class ProductPagination(AsyncPageNumberPagination):
+    page_size = 5
+
+
+class RowComparison(Func):
+    # (a, b, c) > (x, y, z) as a row-value comparison: PostgreSQL and SQLite use it as the bound of an index scan
+    # on (a, b, c), where the equivalent OR expansion is only a filter over the rows the index returns.
+    output_field = BooleanField()
+
+    def __init__(self, columns, values, operator):
+        self.operator = operator
+        super().__init__(*columns, *values)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        parts, params = [], []
+        for expression in self.get_source_expressions():
+            sql, expression_params = compiler.compile(expression)
+            parts.append(sql)
+            params.extend(expression_params)
+        half = len(parts) // 2
+        return f'({", ".join(parts[:half])}) {self.operator} ({", ".join(parts[half:])})', params
+
+
+# Keyset pagination: the cursor carries the ordering values of the last row, so the next page is a
+# "WHERE (a, b) < (x, y) LIMIT n" instead of a COUNT(*) plus an OFFSET that grows with the page number.
+class KeysetPagination(BasePagination):
+    page_size = 10
+    ordering = ('-id',)  # the last field must be unique so rows with equal values don't get skipped
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_ordering(self, request, queryset, view):
+        return self.ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.page_queryset(queryset, request, view)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        # the same page read with the async ORM, for the async views
+        return self.set_page([row async for row in self.page_queryset(queryset, request, view)])
+
+    def page_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.fields = self.get_ordering(request, queryset, view)
+        queryset = queryset.order_by(*self.fields)
+
+        position = self.decode_cursor(request, queryset)
+        if position is not None:
+            queryset = queryset.filter(self.after(position, queryset))
+        return queryset[:self.page_size + 1]  # one extra row tells us whether there is a next page
+
+    def set_page(self, rows):
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def after(self, position, queryset):
+        names = [field.lstrip('-') for field in self.fields]
+        descending = [field.startswith('-') for field in self.fields]
+        if all(descending) or not any(descending):
+            # one direction: (a, b, c) > (x, y, z), or < when descending
+            values = [Value(value, output_field=self.cursor_field(queryset, name)) for name, value in zip(names, position)]
+            return RowComparison([F(name) for name in names], values, '<' if descending[0] else '>')
+
+        # mixed directions have no row-value form:
+        # a > x  OR  (a = x AND b < y)  OR  (a = x AND b = y AND c > z),
+        # ANDed with a >= x so the index on the leading field still gets a bound
+        condition = Q()
+        equal = Q()
+        for name, desc, value in zip(names, descending, position):
+            condition |= equal & Q(**{f'{name}__{"lt" if desc else "gt"}': value})
+            equal &= Q(**{name: value})
+        return Q(**{f'{names[0]}__{"lte" if descending[0] else "gte"}': position[0]}) & condition
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            position = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.fields):
+            raise NotFound(self.invalid_cursor_message)
+        # the values come from the client: each one is checked and converted by the field it is compared with
+        try:
+            position = [self.cursor_field(queryset, field.lstrip('-')).to_python(value) for field, value in zip(self.fields, position)]
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if None in position:
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def cursor_field(self, queryset, name):
+        # the model field (or annotation, e.g. the search rank) behind an ordering name like 'price' or 'product__title'
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        model = queryset.model
+        for part in name.split('__'):
+            field = model._meta.pk if part == 'pk' else model._meta.get_field(part)
+            model = field.related_model
+        return field
+
+    def encode_cursor(self, row):
+        position = [self.cursor_value(row, field.lstrip('-')) for field in self.fields]
+        encoded = urlsafe_b64encode(json.dumps(position).encode('ascii')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def cursor_value(self, row, name):
+        value = row[name] if isinstance(row, dict) else getattr(row, name)
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return value if isinstance(value, (int, float, str)) else str(value)  # Decimal & co. round-trip through their string form
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class ProductCursorPagination(KeysetPagination):
+    page_size = 5
+    approximate_count_query_param = 'approximate_count'
+
+    def get_ordering(self, request, queryset, view):
+        # Keyset over whatever order the filters left (?ordering=, search relevance) with id as the tiebreaker,
+        # in the same direction so a (price, id) / (when_uploaded, id) index can be walked either way.
+        # The SQLite search rank is an extra() column that can't be filtered on, so it isn't part of the key.
+        ordering = [field for field in queryset.query.order_by
+                    if isinstance(field, str) and field.lstrip('-') not in queryset.query.extra_select]
+        if not any(field.lstrip('-') in ['id', 'pk'] for field in ordering):
+            ordering.append('-id' if ordering and ordering[-1].startswith('-') else 'id')
+        return tuple(ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.approximate_count = None
+        if request.query_params.get(self.approximate_count_query_param) in ['1', 'true']:
+            self.approximate_count = self.get_approximate_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.approximate_count = None
+        if request.query_params.get(self.approximate_count_query_param) in ['1', 'true']:
+            if connections[queryset.db].vendor == 'postgresql':
+                self.approximate_count = await sync_to_async(self.get_approximate_count)(queryset)  # a raw cursor, no async API
+            else:
+                self.approximate_count = await queryset.acount()
+        return await super().apaginate_queryset(queryset, request, view)
+
+    def get_approximate_count(self, queryset):
+        # PostgreSQL: the planner's row estimate, no COUNT(*) over the filtered set. Elsewhere: a real count.
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return queryset.count()
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']['Plan Rows']
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.approximate_count is not None:
+            response['X-Approximate-Count'] = self.approximate_count
+        return response
+
+
+class ReviewPagination(KeysetPagination):
+    page_size = 10
+    ordering = ('-posted_at', '-id')
+
+
+class OrderPagination(KeysetPagination):
+    page_size = 10
+    ordering = ('-placed_at', '-id')
+
+
+class CustomerPagination(KeysetPagination):
+    page_size = 10
+    ordering = ('first_name', 'last_name', 'id')
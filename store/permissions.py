@@ -1,5 +1,59 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
 from rest_framework import permissions
 from rest_framework.permissions import IsAuthenticated, DjangoModelPermissions
+from .caching import acache_version, bump_cache_version, cache_version, shared_cache
+
+
+# A user's permission set is read from the auth tables once and then shared through the cache.
+# The key carries a version that is bumped whenever groups, permissions or memberships change.
+# Only with a shared cache backend (see shared_cache()), otherwise every request reads them as before.
+PERMISSIONS_VERSION_KEY = 'store:perms:version'
+
+
+def cached_permissions(user):
+    if not shared_cache():
+        return user.get_all_permissions()
+    key = f'store:perms:{cache_version(PERMISSIONS_VERSION_KEY)}:{user.pk}'
+    perms = cache.get(key)
+    if perms is None:
+        perms = user.get_all_permissions()  # user + group permissions, two joins
+        cache.set(key, perms, getattr(settings, 'STORE_PERMISSIONS_CACHE_TIMEOUT', 60 * 15))
+    return perms
+
+
+async def acached_permissions(user):
+    # cached_permissions() for the async views
+    if not shared_cache():
+        return await sync_to_async(user.get_all_permissions)()
+    key = f'store:perms:{await acache_version(PERMISSIONS_VERSION_KEY)}:{user.pk}'
+    perms = await cache.aget(key)
+    if perms is None:
+        perms = await sync_to_async(user.get_all_permissions)()
+        await cache.aset(key, perms, getattr(settings, 'STORE_PERMISSIONS_CACHE_TIMEOUT', 60 * 15))
+    return perms
+
+
+def invalidate_permissions():
+    bump_cache_version(PERMISSIONS_VERSION_KEY)
+
+
+def has_cached_perms(user, perms):
+    # same answers as user.has_perms() with the default ModelBackend
+    if not user.is_active:
+        return False
+    if user.is_superuser:
+        return True
+    return set(perms) <= cached_permissions(user)
+
+
+async def ahas_cached_perms(user, perms):
+    if not user.is_active:
+        return False
+    if user.is_superuser:
+        return True
+    return set(perms) <= await acached_permissions(user)
 
 
 class IsAdminOrReadOnly(permissions.BasePermission):
@@ -10,5 +64,20 @@ class IsAdminOrReadOnly(permissions.BasePermission):
         return bool(request.user and request.user.is_staff)
 
 class FullDjangoModelPermissions(permissions.DjangoModelPermissions):
-    def __init__(self)-> None:
-        self.perms_map['GET'] = ['%(app_label)s.view_%(model_name)s']
\ No newline at end of file
+    # def __init__(self)-> None:
+    #     self.perms_map['GET'] = ['%(app_label)s.view_%(model_name)s']
+    # A copy, so GET doesn't end up requiring view_ permissions on every DjangoModelPermissions in the project
+    perms_map = {**permissions.DjangoModelPermissions.perms_map, 'GET': ['%(app_label)s.view_%(model_name)s']}
+
+    def has_permission(self, request, view):
+        if getattr(view, '_ignore_model_permissions', False):
+            return True
+
+        if not request.user or (
+           not request.user.is_authenticated and self.authenticated_users_only):
+            return False
+
+        queryset = self._queryset(view)
+        perms = self.get_required_permissions(request.method, queryset.model)
+
+        return has_cached_perms(request.user, perms)
\ No newline at end of file
@@ -0,0 +1,80 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+
+# This builds select_related / prefetch_related / only() for a queryset by reading the fields a serializer renders,
+# so list endpoints don't fire one query per row for every nested serializer or related field.
+# `include` names extra columns to keep, e.g. the FK back to the parent when the result is used in a Prefetch.
+def optimize_queryset(queryset, serializer, include=()):
+    if isinstance(serializer, type):
+        serializer = serializer()
+    only, select, prefetch = _plan(queryset.model, serializer)
+    if only:
+        only.extend(include)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    if only:
+        queryset = queryset.only(*only)
+    return queryset
+
+
+def _reverse_relations(model):
+    # reverse FKs are reached through their accessor name (e.g. 'image' or 'orderitem_set'), not the field name
+    return {rel.get_accessor_name(): rel for rel in model._meta.related_objects}
+
+
+def _plan(model, serializer, prefix=''):
+    only = [prefix + model._meta.pk.name]
+    select, prefetch = [], []
+    load_all = False
+    reverse = _reverse_relations(model)
+
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            # SerializerMethodField and friends read the whole instance, so they can only use columns declared elsewhere
+            continue
+        name = field.source_attrs[0]
+        nested = field.child if isinstance(field, serializers.ListSerializer) else field
+        if isinstance(field, serializers.ManyRelatedField):
+            nested = field.child_relation
+
+        if name in reverse:
+            rel = reverse[name]
+            prefetch.append(_prefetch(prefix + name, rel.related_model, nested, rel.field.name))
+            continue
+
+        try:
+            model_field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # a property on the model, we can't tell what it reads so load every column
+            load_all = True
+            continue
+
+        if model_field.many_to_many:
+            prefetch.append(_prefetch(prefix + name, model_field.related_model, nested))
+        elif model_field.is_relation:
+            only.append(prefix + model_field.name)
+            if isinstance(nested, serializers.PrimaryKeyRelatedField) and len(field.source_attrs) == 1:
+                continue  # the pk is already on the row, no join needed
+            select.append(prefix + name)
+            if isinstance(nested, serializers.BaseSerializer):
+                sub_only, sub_select, sub_prefetch = _plan(model_field.related_model, nested, prefix + name + '__')
+                only.extend(sub_only)
+                select.extend(sub_select)
+                prefetch.extend(sub_prefetch)
+            # StringRelatedField & co. call into the related object, naming no columns of it keeps them all
+        else:
+            only.append(prefix + model_field.name)
+
+    return ([] if load_all else only), select, prefetch
+
+
+def _prefetch(lookup, related_model, nested, back_reference=None):
+    if not isinstance(nested, serializers.BaseSerializer):
+        return lookup
+    # the prefetch needs the FK back to the parent to stitch the rows together
+    queryset = optimize_queryset(related_model.objects.all(), nested, include=[back_reference] if back_reference else [])
+    return Prefetch(lookup, queryset=queryset)
@@ -0,0 +1,160 @@
+from abc import ABC, abstractmethod
+from decimal import Decimal
+
+from django.db.models import QuerySet
+from rest_framework import serializers
+from rest_framework.response import Response
+
+from .images import variant_storage_name
+from .models import OrderItem, ProductImage
+
+# Read-only list serializers that build the response dicts straight from .values() rows instead of model instances
+# going through a ModelSerializer field by field. The output is the same document ProductSerializer / OrderSerializer
+# produce; nested rows are fetched with one extra .values() query per page.
+TAX_RATE = Decimal(0.45)  # the same rate (and float rounding) as ProductSerializer.calc_tax
+
+_datetime = serializers.DateTimeField()  # DRF's own formatting (timezone, ISO 8601, Z)
+
+
+class ValuesSerializer(ABC):
+    values = ()  # columns read from the queryset
+    annotations = {}  # computed by the database
+
+    def __init__(self, instance=None, many=False, context=None):
+        self.instance = instance
+        self.many = many
+        self.context = context or {}
+
+    @classmethod
+    def prepare(cls, queryset):
+        # keeps the view's filtering and ordering; the ordering columns come along so keyset cursors can read them
+        ordering = [field.lstrip('-') for field in queryset.query.order_by if isinstance(field, str)]
+        columns = [*cls.values, *cls.annotations]
+        columns += [name for name in dict.fromkeys(ordering) if name not in columns and name != 'pk']
+        return queryset.prefetch_related(None).annotate(**cls.annotations).values(*columns)
+
+    @property
+    def data(self):
+        rows = list(self.instance) if self.many else [self.instance]
+        related = self.related_queryset(rows)
+        self.set_related(list(related) if related is not None else [])
+        return self.to_representation_many(rows)
+
+    async def adata(self):
+        # .data for the async views, the same queries through the async ORM
+        if not self.many:
+            rows = [self.instance]
+        elif isinstance(self.instance, QuerySet):
+            rows = [row async for row in self.instance]
+        else:
+            rows = list(self.instance)
+        related = self.related_queryset(rows)
+        self.set_related([row async for row in related] if related is not None else [])
+        return self.to_representation_many(rows)
+
+    def to_representation_many(self, rows):
+        representation = [self.to_representation(row) for row in rows]
+        return representation if self.many else representation[0]
+
+    def related_queryset(self, rows):
+        # the one .values() query for the nested rows of the whole page, if there are any
+        return None
+
+    def set_related(self, related_rows):
+        pass
+
+    @abstractmethod
+    def to_representation(self, row):
+        pass
+
+    def absolute_url(self, url):
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None and url else url
+
+
+class ProductValuesSerializer(ValuesSerializer):
+    values = ('id', 'title', 'description', 'price', 'category')
+
+    def related_queryset(self, rows):
+        return ProductImage.objects.filter(product_id__in=[row['id'] for row in rows]).order_by('pk').values('id', 'product_id', 'image', 'variants')
+
+    def set_related(self, image_rows):
+        self.images = {}
+        for image in image_rows:
+            self.images.setdefault(image['product_id'], []).append(self.image_representation(image))
+
+    def image_representation(self, image):
+        # ProductImageVariantSerializer, from a row
+        storage = ProductImage._meta.get_field('image').storage
+        variant = self.context.get('image_variant', 'full')
+        name = variant_storage_name(image['variants'], variant) or image['image']
+        webp = variant_storage_name(image['variants'], variant, 'webp')
+        return {
+            'id': image['id'],
+            'image': self.absolute_url(storage.url(name) if name else None),
+            'webp': self.absolute_url(storage.url(webp) if webp else None),
+        }
+
+    def to_representation(self, row):
+        return {
+            'id': row['id'],
+            'title': row['title'],
+            'description': row['description'],
+            'price': row['price'],
+            'category': row['category'],
+            'product_tax': row['price'] * TAX_RATE,  # in Python like calc_tax: SQLite would multiply in floating point
+            'image': self.images.get(row['id'], []),
+        }
+
+
+class OrderValuesSerializer(ValuesSerializer):
+    values = ('id', 'customer', 'placed_at', 'payment_status', 'delivery_status')
+
+    def related_queryset(self, rows):
+        return OrderItem.objects.filter(order_id__in=[row['id'] for row in rows]).order_by('pk').values(
+            'id', 'order_id', 'product_id', 'product__title', 'product__price', 'product__category__title', 'price', 'quantity',
+        )
+
+    def set_related(self, item_rows):
+        self.items = {}
+        for item in item_rows:
+            self.items.setdefault(item['order_id'], []).append({
+                'id': item['id'],
+                'product': {  # SimpleProductSerializer
+                    'id': item['product_id'],
+                    'title': item['product__title'],
+                    'price': item['product__price'],
+                    'category': item['product__category__title'],
+                },
+                'price': item['price'],
+                'quantity': item['quantity'],
+            })
+
+    def to_representation(self, row):
+        return {
+            'id': row['id'],
+            'items': self.items.get(row['id'], []),
+            'customer': row['customer'],
+            'placed_at': _datetime.to_representation(row['placed_at']),
+            'payment_status': row['payment_status'],
+            'delivery_status': row['delivery_status'],
+        }
+
+
+class ValuesListMixin:
+    # Serves `list` through a ValuesSerializer when the view names one for the action, e.g.
+    # values_serializer_classes = {'list': ProductValuesSerializer}. get_serializer() is left alone,
+    # so writes, the browsable API forms and the other actions keep using the regular serializer.
+    values_serializer_classes = {}
+
+    def list(self, request, *args, **kwargs):
+        serializer_class = self.values_serializer_classes.get(self.action)
+        if serializer_class is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = serializer_class.prepare(self.filter_queryset(self.get_queryset()))
+        context = self.get_serializer_context()
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer_class(page, many=True, context=context).data)
+        return Response(serializer_class(queryset, many=True, context=context).data)
@@ -0,0 +1,86 @@
+import datetime
+import decimal
+
+from django.conf import settings
+from django.db.models.query import QuerySet
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+
+try:
+    import orjson
+except ImportError:  # optional, without it these behave exactly like DRF's JSONRenderer / JSONParser
+    orjson = None
+
+
+# orjson backed drop-ins for DRF's JSON renderer and parser, switched on in REST_FRAMEWORK settings.
+# orjson encodes dicts, lists, str, int, float, UUID and datetimes natively in C; the types it doesn't know
+# go through `default`, which converts them the way rest_framework.utils.encoders.JSONEncoder does.
+# Differences from DRF: NaN/Infinity become null instead of raising, ?indent= is always 2 spaces, and floats
+# with an exponent are written 1e20 rather than 1e+20 (the same number).
+def default(obj):
+    if isinstance(obj, decimal.Decimal):
+        # COERCE_DECIMAL_TO_STRING only reaches DecimalFields; Decimals put into response data directly land here
+        return float(obj)
+    if isinstance(obj, Promise):
+        return force_str(obj)
+    if isinstance(obj, datetime.timedelta):
+        return str(obj.total_seconds())
+    if isinstance(obj, QuerySet):
+        return tuple(obj)
+    if isinstance(obj, bytes):
+        return obj.decode()
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()  # numpy scalars and arrays
+    if hasattr(obj, '__getitem__'):
+        try:
+            return dict(obj)
+        except (TypeError, ValueError):
+            pass
+    if hasattr(obj, '__iter__'):
+        return tuple(obj)
+    raise TypeError(f'Type is not JSON serializable: {type(obj).__name__}')
+
+
+# same escaping as JSONRenderer, these two are valid JSON but end a line in JavaScript
+LINE_SEPARATORS = [(b'\xe2\x80\xa8', b'\\u2028'), (b'\xe2\x80\xa9', b'\\u2029')]
+
+
+class ORJSONRenderer(JSONRenderer):
+    options = (orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or not api_settings.UNICODE_JSON:
+            # orjson always writes UTF-8, UNICODE_JSON = False (\u escapes) stays with the stdlib encoder
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+
+        options = self.options
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            options |= orjson.OPT_INDENT_2
+        ret = orjson.dumps(data, default=default, option=options)
+        for separator, escaped in LINE_SEPARATORS:
+            if separator in ret:
+                ret = ret.replace(separator, escaped)
+        return ret
+
+
+class ORJSONParser(JSONParser):
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            data = stream.read()
+            if encoding.lower().replace('-', '') != 'utf8':
+                data = data.decode(encoding)
+            return orjson.loads(data)
+        except (ValueError, UnicodeDecodeError) as exc:  # orjson.JSONDecodeError is a ValueError
+            raise ParseError('JSON parse error - %s' % str(exc))
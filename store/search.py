@@ -0,0 +1,148 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
+from rest_framework.filters import SearchFilter
+
+
+# Full text search for products.
+# PostgreSQL: a tsvector column (Product.search_document) filled in by a trigger and GIN indexed.
+# SQLite (local runs): an FTS5 table kept in sync with store_product by triggers.
+# Anything else, or STORE_SEARCH_BACKEND = 'icontains', falls back to DRF's SearchFilter.
+SEARCH_CONFIG = 'english'
+
+POSTGRES_INSTALL = [
+    """
+    CREATE OR REPLACE FUNCTION store_product_search_document() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_document :=
+            setweight(to_tsvector('{config}', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('{config}', coalesce(NEW.description, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS store_product_search_document ON store_product",
+    """
+    CREATE TRIGGER store_product_search_document BEFORE INSERT OR UPDATE OF title, description, search_document
+    ON store_product FOR EACH ROW EXECUTE PROCEDURE store_product_search_document()
+    """,
+    "UPDATE store_product SET title = title",  # fires the trigger once for the existing rows
+    "CREATE INDEX IF NOT EXISTS store_product_search_document_gin ON store_product USING gin (search_document)",
+]
+
+POSTGRES_UNINSTALL = [
+    "DROP INDEX IF EXISTS store_product_search_document_gin",
+    "DROP TRIGGER IF EXISTS store_product_search_document ON store_product",
+    "DROP FUNCTION IF EXISTS store_product_search_document()",
+]
+
+SQLITE_INSTALL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS store_product_fts USING fts5(title, description, content='store_product', content_rowid='id')",
+    """
+    CREATE TRIGGER IF NOT EXISTS store_product_fts_insert AFTER INSERT ON store_product BEGIN
+        INSERT INTO store_product_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS store_product_fts_delete AFTER DELETE ON store_product BEGIN
+        INSERT INTO store_product_fts(store_product_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS store_product_fts_update AFTER UPDATE ON store_product BEGIN
+        INSERT INTO store_product_fts(store_product_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO store_product_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """,
+    "INSERT INTO store_product_fts(store_product_fts) VALUES ('rebuild')",
+]
+
+SQLITE_UNINSTALL = [
+    "DROP TRIGGER IF EXISTS store_product_fts_insert",
+    "DROP TRIGGER IF EXISTS store_product_fts_delete",
+    "DROP TRIGGER IF EXISTS store_product_fts_update",
+    "DROP TABLE IF EXISTS store_product_fts",
+]
+
+
+def install_search_index(connection):
+    # Idempotent; the migrations carry their own frozen copies, this is for ensure_search_index() and scripts.
+    statements = {'postgresql': POSTGRES_INSTALL, 'sqlite': SQLITE_INSTALL}.get(connection.vendor, [])
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement.format(config=SEARCH_CONFIG))
+
+
+def search_index_missing(connection):
+    # True when a trigger or the index/FTS table isn't there, e.g. SQLite silently drops a table's triggers
+    # when a migration rebuilds it (any AddField/AlterField on store_product)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                "SELECT to_regclass('store_product_search_document_gin') IS NULL"
+                " OR NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'store_product_search_document')"
+            )
+            return cursor.fetchone()[0]
+        if connection.vendor == 'sqlite':
+            names = ['store_product_fts', 'store_product_fts_insert', 'store_product_fts_delete', 'store_product_fts_update']
+            cursor.execute(f"SELECT count(*) FROM sqlite_master WHERE name IN ({', '.join(['%s'] * len(names))})", names)
+            return cursor.fetchone()[0] < len(names)
+    return False
+
+
+def ensure_search_index(connection):
+    # Run after every migrate (store/signals.py), so a later migration that rebuilds store_product can't leave
+    # search quietly stale. Only (re)installs, and reindexes, when something is missing.
+    if search_index_missing(connection):
+        install_search_index(connection)
+        return True
+    return False
+
+
+def uninstall_search_index(connection):
+    statements = {'postgresql': POSTGRES_UNINSTALL, 'sqlite': SQLITE_UNINSTALL}.get(connection.vendor, [])
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def search_backend(connection):
+    backend = getattr(settings, 'STORE_SEARCH_BACKEND', 'auto')
+    if backend == 'auto':
+        return connection.vendor if connection.vendor in ['postgresql', 'sqlite'] else 'icontains'
+    return backend
+
+
+def fts5_query(terms):
+    # every word quoted, so user input can't use (or break on) FTS5 query syntax; words are ANDed
+    return ' '.join('"%s"' % word.replace('"', '""') for word in terms.split())
+
+
+class ProductSearchFilter(SearchFilter):
+    # Drop-in for SearchFilter on ProductViewSet: same ?search= param, results ordered by relevance
+    # unless ?ordering= is given (OrderingFilter runs after this one).
+    def filter_queryset(self, request, queryset, view):
+        terms = ' '.join(self.get_search_terms(request))
+        if not terms:
+            return queryset
+
+        backend = search_backend(connections[queryset.db])
+        if backend == 'postgresql':
+            query = SearchQuery(terms, config=SEARCH_CONFIG, search_type='websearch')
+            return queryset.filter(search_document=query).annotate(
+                # ts_rank is a float4; as a double its value survives the round trip through a pagination cursor
+                search_rank=Cast(SearchRank(F('search_document'), query), FloatField())
+            ).order_by('-search_rank', 'id')
+
+        if backend == 'sqlite':
+            # joined rather than a correlated subquery, so bm25() is computed once per match and not re-run per row
+            return queryset.extra(
+                tables=['store_product_fts'],
+                where=['store_product_fts.rowid = store_product.id', 'store_product_fts MATCH %s'],
+                params=[fts5_query(terms)],
+                select={'search_rank': 'bm25(store_product_fts)'},  # lower is more relevant
+            ).order_by('search_rank', 'id')
+
+        return super().filter_queryset(request, queryset, view)
@@ -1,10 +1,16 @@
-from decimal import Decimal
-from django.db import transaction
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Exists, F, OuterRef
 from rest_framework import serializers
-from . models import Product, Category, Review, Cart, CartItem, Customer, Order, OrderItem, ProductImage
+from . models import Product, Category, Review, Cart, CartItem, Customer, Order, OrderEvent, OrderItem, ProductImage
+from . events import publish
+from . inventory import OutOfStock, reserve_stock, shortages
+from . images import variant_url
+from . readonly import TAX_RATE
 from rest_framework.validators import ValidationError
 from djoser.serializers import UserCreateSerializer as BaseUserCreateSerializer
 from djoser.serializers import UserSerializer as BaseUserSerializer
+from djoser.conf import settings as djoser_settings
+from . onboarding import build_user
 
 
 
@@ -36,18 +42,48 @@ class CategorySerializer(serializers.ModelSerializer):
 #     def calc_tax(self, prod): # The parameter 'prod', represents the instance of the product model you are calling.
 #         return prod.price * Decimal(0.45)
 
+def absolute_url(context, url):
+    request = context.get('request')
+    return request.build_absolute_uri(url) if request is not None and url else url
+
+
 class ProductImageSerializer(serializers.ModelSerializer):
+    variants = serializers.SerializerMethodField()  # Empty until the image workers have resized the upload
+
     def create(self, validated_data):
         myid = self.context['prod_id']
         return ProductImage.objects.create(product_id=myid, **validated_data)
 
+    def get_variants(self, product_image):
+        return {
+            variant: {extension: absolute_url(self.context, variant_url(product_image, variant, extension)) for extension in encodings}
+            for variant, encodings in product_image.variants.items()
+        }
+
+    class Meta:
+        model = ProductImage
+        fields = ['id','image', 'variants']
+
+
+class ProductImageVariantSerializer(serializers.ModelSerializer):
+    # The image a product page actually needs: the 'card' variant in lists and 'full' on the detail page
+    # (the view passes `image_variant` in the context), plus its WebP copy. The original until the variants exist.
     class Meta:
         model = ProductImage
-        fields = ['id','image']
+        fields = ['id', 'image', 'variants']  # both read by to_representation, and so loaded by optimize_queryset
+
+    def to_representation(self, product_image):
+        variant = self.context.get('image_variant', 'full')
+        url = variant_url(product_image, variant) or (product_image.image.url if product_image.image else None)
+        return {
+            'id': product_image.id,
+            'image': absolute_url(self.context, url),
+            'webp': absolute_url(self.context, variant_url(product_image, variant, 'webp')),
+        }
 
 
 class ProductSerializer(serializers.ModelSerializer):
-    image = ProductImageSerializer(many=True, read_only=True)
+    image = ProductImageVariantSerializer(many=True, read_only=True)
     class Meta:
         model = Product
         fields = ['id', 'title', 'description','price', 'category', 'product_tax', 'image']
@@ -83,7 +119,7 @@ class ProductSerializer(serializers.ModelSerializer):
     # unit_price = serializers.DecimalField(max_digits=6, decimal_places=2, source='price')  # This is to customise the model field
     product_tax = serializers.SerializerMethodField(method_name='calc_tax')
     def calc_tax(self, prod):
-        return prod.price * Decimal(0.45)
+        return prod.price * TAX_RATE  # Decimal(0.45), also used by ProductValuesSerializer
 
         
 class SimpleProductSerializer(serializers.ModelSerializer):
@@ -94,22 +130,33 @@ class SimpleProductSerializer(serializers.ModelSerializer):
 
 
 class ReviewSerializer(serializers.ModelSerializer):
-    product = ProductSerializer()
+    # product = ProductSerializer()
+    product = serializers.SerializerMethodField()  # Every review on a page belongs to the same product, so the view serializes it once
     class Meta:
         model = Review
         fields = ['id', 'posted_at', 'reviewer_name', 'remark', 'product']
 
+    def get_product(self, review):
+        if 'product' in self.context:
+            return self.context['product']
+        return ProductSerializer(review.product, context=self.context).data
+
+    def create(self, validated_data):
+        return Review.objects.create(product_id=self.context['product_id'], **validated_data)
+
 
 class CartItemSerializer(serializers.ModelSerializer):
     # id = serializers.UUIDField(read_only=True)
     product = SimpleProductSerializer()
     class Meta:
         model = CartItem
-        fields = ['id', 'product', 'quantity', 'sub_ ']
+        fields = ['id', 'product', 'quantity', 'sub_total']
     
     sub_total = serializers.SerializerMethodField()
 
     def get_sub_total(self, item:CartItem):
+        if hasattr(item, 'line_total'):  # computed by the database when the view annotated it
+            return item.line_total
         return item.quantity * item.product.price
 
 # class AddCartItemSerializer(serializers.ModelSerializer):
@@ -133,10 +180,11 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         model = CartItem
         fields = ['id', 'product_id', 'quantity']
 
-    def validate_product_id(self, value):
-        if not Product.objects.filter(pk=value).exists():
-            raise serializers.ValidationError('Sorry bros the items youa re trying to fetch is not in the DB')
-        return value
+    # The product check now happens inside the upsert itself (no row comes back for an unknown product)
+    # def validate_product_id(self, value):
+    #     if not Product.objects.filter(pk=value).exists():
+    #         raise serializers.ValidationError('Sorry bros the items youa re trying to fetch is not in the DB')
+    #     return value
     
     # def validate_quantity(self, value):
     #     if quantity < 1:
@@ -148,25 +196,104 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         quantity = self.validated_data['quantity']
         cart_id = self.context['cart_id']
 
-        cartitem = CartItem.objects.filter(product_id=product_id, cart_id=cart_id).first()
-        if cartitem:
-            cartitem.quantity += quantity
-            cartitem.save()
-            self.instance = cartitem
-        else:
-            # self.instance = CartItem.objects.create(cart_id=cart_id, **self.validated_data)
-            newitem = CartItem.objects.create(cart_id=cart_id, **self.validated_data)
-            self.instance = newitem
+        # cartitem = CartItem.objects.filter(product_id=product_id, cart_id=cart_id).first()
+        # if cartitem:
+        #     cartitem.quantity += quantity
+        #     cartitem.save()
+        #     self.instance = cartitem
+        # else:
+        #     newitem = CartItem.objects.create(cart_id=cart_id, **self.validated_data)
+        #     self.instance = newitem
+        row = self.upsert(cart_id, product_id, quantity)
+        if row is None:
+            # the product is checked first, as validate_product_id used to: same 400 body for an unknown product
+            if not Product.objects.filter(pk=product_id).exists():
+                raise serializers.ValidationError({'product_id': ['Sorry bros the items youa re trying to fetch is not in the DB']})
+            raise serializers.ValidationError('Invalid cart is supplied')
+        self.instance = CartItem(id=row[0], cart_id=cart_id, product_id=product_id, quantity=row[1])
         return self.instance
 
+    def upsert(self, cart_id, product_id, quantity):
+        # Adds to the quantity in one statement, so concurrent adds of the same product don't lose increments.
+        # The SELECT only yields a row when both the cart and the product exist, which doubles as validation.
+        if connection.vendor in ['postgresql', 'sqlite'] and connection.features.can_return_columns_from_insert:
+            db_cart_id = CartItem._meta.get_field('cart').get_db_prep_value(cart_id, connection)
+            with connection.cursor() as cursor:
+                cursor.execute(UPSERT_CART_ITEM_SQL.format(
+                    cartitem=CartItem._meta.db_table, cart=Cart._meta.db_table, product=Product._meta.db_table,
+                ), [quantity, db_cart_id, product_id])
+                return cursor.fetchone()
+
+        # Other databases: increment with an F() expression, create when there was nothing to increment
+        with transaction.atomic():
+            if not (Cart.objects.filter(id=cart_id).exists() and Product.objects.filter(pk=product_id).exists()):
+                return None
+            items = CartItem.objects.filter(cart_id=cart_id, product_id=product_id)
+            if not items.update(quantity=F('quantity') + quantity):
+                try:
+                    with transaction.atomic():
+                        CartItem.objects.create(cart_id=cart_id, product_id=product_id, quantity=quantity)
+                except IntegrityError:  # another request created it first
+                    items.update(quantity=F('quantity') + quantity)
+            return items.values_list('id', 'quantity').get()
+
+
+UPSERT_CART_ITEM_SQL = """
+    INSERT INTO {cartitem} (cart_id, product_id, quantity)
+    SELECT {cart}.id, {product}.id, %s FROM {cart}, {product}
+    WHERE {cart}.id = %s AND {product}.id = %s
+    ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = {cartitem}.quantity + excluded.quantity
+    RETURNING id, quantity
+"""
+
         
 
+class BulkCartItemListSerializer(serializers.ListSerializer):
+    def validate(self, items):
+        if not Cart.objects.filter(id=self.context['cart_id']).exists():
+            raise serializers.ValidationError('Invalid cart is supplied')
+        product_ids = {item['product_id'] for item in items}
+        found = set(Product.objects.filter(pk__in=product_ids).values_list('id', flat=True))  # one IN query for the whole list
+        missing = product_ids - found
+        if missing:
+            raise serializers.ValidationError(f'These products are not in the DB: {sorted(missing)}')
+        return items
+
+    def save(self, **kwargs):
+        cart_id = self.context['cart_id']
+        quantities = {}
+        for item in self.validated_data:  # the same product twice in one payload is added up into one line
+            quantities[item['product_id']] = quantities.get(item['product_id'], 0) + item['quantity']
+        with transaction.atomic():
+            # the cart is locked, so a checkout or purge that deleted it since validate() is a 400, not a foreign key error
+            if not Cart.objects.select_for_update().filter(id=cart_id).exists():
+                raise serializers.ValidationError('Invalid cart is supplied')
+            self.instance = CartItem.objects.bulk_create(
+                [CartItem(cart_id=cart_id, product_id=product_id, quantity=quantity) for product_id, quantity in quantities.items()],
+                update_conflicts=True,
+                unique_fields=['cart_id', 'product_id'],
+                update_fields=['quantity'],
+            )
+        return self.instance
+
+
+class BulkCartItemSerializer(serializers.ModelSerializer):
+    # Sets the quantity of every listed product in the cart in one statement (used to restore a saved cart)
+    product_id = serializers.IntegerField()
+    class Meta:
+        model = CartItem
+        fields = ['product_id', 'quantity']
+        list_serializer_class = BulkCartItemListSerializer
+
+
 class CartSerializer(serializers.ModelSerializer):
     id = serializers.UUIDField(read_only=True)  # to show nothing in the raw in the browseable API
     items = CartItemSerializer(source='cartitem_set', many=True, read_only=True)
     grand_total = serializers.SerializerMethodField()
 
     def get_grand_total(self, cart:Cart):
+        if hasattr(cart, 'grand_total'):  # computed by the database when the view annotated it
+            return cart.grand_total
         return sum([item.quantity * item.product.price for item in cart.cartitem_set.all()])
 
     class Meta:
@@ -208,6 +335,18 @@ class UserCreateSerializer(BaseUserCreateSerializer):
     class Meta(BaseUserCreateSerializer.Meta):
         fields = ['id', 'username', 'email','password', 'first_name', 'last_name']
 
+    def perform_create(self, validated_data):
+        # The user and its customer in one transaction, one INSERT each: the customer isn't left to the post_save
+        # signal, and the inactive flag for activation emails is set before the save instead of in a second UPDATE.
+        with transaction.atomic():
+            user = build_user(**validated_data)
+            if djoser_settings.SEND_ACTIVATION_EMAIL:
+                user.is_active = False
+            user.creates_own_customer = True
+            user.save()
+            Customer.objects.create(user=user, first_name=user.first_name, last_name=user.last_name)
+        return user
+
 
 class CustomerSerializer(serializers.ModelSerializer):
     user_id = serializers.IntegerField(read_only=True) 
@@ -235,46 +374,79 @@ class CreateOrderSerializer(serializers.Serializer):
     cart_id = serializers.UUIDField()
     
     def validate_cart_id(self, cartid):
-        if not Cart.objects.filter(id=cartid).exists():
+        # One query answers both "does the cart exist" (a row comes back) and "is it empty" (has_items)
+        has_items = Cart.objects.filter(id=cartid).annotate(
+            has_items=Exists(CartItem.objects.filter(cart_id=OuterRef('id')))
+        ).values_list('has_items', flat=True).first()
+        if has_items is None:
             raise serializers.ValidationError('Invalid cart is supplied')
         # return Cart.objects.filter(id=cartid)
 
         # if CartItem.objects.filter(cart_id=cartid).exists() == 0
-        if not CartItem.objects.filter(cart_id=cartid).exists():
+        if not has_items:
             raise serializers.ValidationError('Your cart is empty')
         return cartid
 
-    # @transaction.atomic()
     def save(self, **kwargs):
+        try:
+            return self.place_order()
+        except OutOfStock as exc:
+            # the transaction is rolled back by now, so this reads the stock as it is, not half reserved
+            short = shortages(exc.lines)
+            raise serializers.ValidationError({'cart_id': [f'Only {left} left of product {product_id}' for product_id, left in short] or 'Not enough stock'})
+
+    # @transaction.atomic()
+    def place_order(self):
         with transaction.atomic():
             # print("CARTID >>>>",self.validated_data['cart_id'])
             # print("User ID >>>>",self.context['userid'])
             cart_id = self.validated_data['cart_id']
             user_id = self.context['user_id']
 
+            # 0 locking the cart so two submits of the same cart can't both turn it into an order.
+            # The second one waits here, then finds the cart gone.
+            if not Cart.objects.select_for_update().filter(id=cart_id).exists():
+                raise serializers.ValidationError({'cart_id': 'Invalid cart is supplied'})
+            cartitems = list(CartItem.objects.filter(cart_id=cart_id).values_list(
+                'product_id', 'quantity', 'product__price', 'product__stock', 'product__stock_shards'
+            ))  # items joined with their prices and stock columns in one query
+            if not cartitems:
+                raise serializers.ValidationError({'cart_id': 'Your cart is empty'})
+
+            # 0b taking the stock, every tracked line in one conditional UPDATE (store/inventory.py)
+            reserve_stock([(product_id, quantity, stock, shards) for product_id, quantity, _, stock, shards in cartitems])
+            cartitems = [(product_id, quantity, price) for product_id, quantity, price, _, _ in cartitems]
+
             # return 
             # 1 creating the order
             # (customer, created)=Customer.objects.get_or_create(user_id=user_id)
             # (customer, created)=Customer.objects.get_or_create(user_id=user_id)
-            customer =Customer.objects.get(user_id=user_id)
-            theorder = Order.objects.create(customer=customer, delivery_status='pending')
+            # customer =Customer.objects.get(user_id=user_id)
+            customer_id = Customer.objects.values_list('id', flat=True).get(user_id=user_id)
+            theorder = Order.objects.create(customer_id=customer_id, delivery_status='pending')
             
             # 2 copying the cartitem to create the order item
-            cartitems = CartItem.objects.filter(cart_id=cart_id)
+            # cartitems = CartItem.objects.filter(cart_id=cart_id)
 
             orderitems = [OrderItem
                 (order=theorder,
-                product=items.product, 
-                quantity=items.quantity, 
-                price=items.product.price) for items in cartitems
+                product_id=product_id, 
+                quantity=quantity, 
+                price=price) for product_id, quantity, price in cartitems
             ]
             OrderItem.objects.bulk_create(orderitems)
+
+            # 2b recording the order in the outbox, its side effects run after the commit (store/events.py)
+            publish(theorder, OrderEvent.ORDER_PLACED, {
+                'customer_id': customer_id,
+                'items': [{'product_id': product_id, 'quantity': quantity, 'price': str(price)} for product_id, quantity, price in cartitems],
+                'total': str(sum(quantity * price for _, quantity, price in cartitems)),
+            })
             
             # 3 Deleting the cart
             # thecart = Cart.objects.filter(id=cart_id).exists():
-            thecart = Cart.objects.get(id=cart_id)
-            if thecart:
-                thecart.delete()    
+            # thecart = Cart.objects.get(id=cart_id)
+            Cart.objects.filter(id=cart_id).delete()  # the cart items go with it in a single cascaded delete
             return theorder    
 
             
@@ -1,8 +1,121 @@
-from . models import Customer, User
-from django.db.models.signals import post_save
+from . models import Customer, User, Product, ProductImage, Category
+from django.db.models import F
+from django.db.models.functions import Now
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed, post_migrate
 from django.dispatch import receiver
+from . caching import invalidate_catalogue, forget_customer
+from . authentication import forget_user
+from . permissions import invalidate_permissions
+from django.contrib.auth.models import Group, Permission
+from django.core.exceptions import FieldDoesNotExist
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.apps import apps as global_apps
+from . images import delete_variants, schedule_variants
+from . search import ensure_search_index
+
+
+# The search triggers are checked after every migrate: a migration that rebuilds store_product on SQLite drops
+# them without an error, and its author shouldn't have to remember to put them back
+@receiver(post_migrate)
+def restore_search_index(sender, using=DEFAULT_DB_ALIAS, apps=global_apps, **kwargs):
+    if sender.name != 'store':
+        return
+    # only while the migrations the search objects belong to are applied, not after `migrate store 0007`
+    try:
+        apps.get_model('store', 'Product')._meta.get_field('search_document')
+    except (LookupError, FieldDoesNotExist):
+        return
+    ensure_search_index(connections[using])
+
 
 @receiver(post_save, sender=User)
 def create_customer_for_user(sender, **kwargs):
-    if kwargs['created']:
-        Customer.objects.create(user=kwargs['instance'])
\ No newline at end of file
+    # registration and bulk onboarding (store/onboarding.py) insert the customer themselves
+    user = kwargs['instance']
+    if kwargs['created'] and not getattr(user, 'creates_own_customer', False):
+        Customer.objects.create(user=user, first_name=user.first_name, last_name=user.last_name)
+
+
+# Customer.first_name/last_name are copies used for sorting; saves that can't have touched the names (e.g. last_login) are skipped
+@receiver(post_save, sender=User)
+def copy_names_to_customer(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and not {'first_name', 'last_name'} & set(update_fields)):
+        return
+    Customer.objects.filter(user_id=instance.pk).exclude(first_name=instance.first_name, last_name=instance.last_name).update(
+        first_name=instance.first_name, last_name=instance.last_name
+    )
+
+
+# `me` is served from a per-user cache
+@receiver([post_save, post_delete], sender=Customer)
+def forget_cached_customer(sender, instance, **kwargs):
+    forget_customer(instance.user_id)
+
+
+# A user that changed (password, is_active, groups...) or is gone must not be served from the auth cache
+@receiver([post_save, post_delete], sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+# Cached permission sets are dropped whenever a grant or a membership changes
+@receiver([post_save, post_delete], sender=Group)
+@receiver([post_save, post_delete], sender=Permission)
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_cached_permissions(sender, **kwargs):
+    invalidate_permissions()
+
+
+# Any change to what a product page shows drops the cached catalogue pages
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=Category)
+@receiver(m2m_changed, sender=Product.promotions.through)
+def invalidate_catalogue_cache(sender, **kwargs):
+    invalidate_catalogue()
+
+
+# A product's images are part of its representation, so they move its last_updated (ETag / Last-Modified)
+@receiver([post_save, post_delete], sender=ProductImage)
+def touch_product(sender, instance, **kwargs):
+    if not kwargs.get('raw'):
+        Product.objects.filter(pk=instance.product_id).update(last_updated=Now())
+
+
+# Variants are made by the image worker pool once the upload is committed, so the request doesn't wait for Pillow
+@receiver(post_save, sender=ProductImage)
+def generate_image_variants(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return
+    transaction.on_commit(lambda: schedule_variants(instance.pk))
+
+
+@receiver(post_delete, sender=ProductImage)
+def delete_image_variants(sender, instance, **kwargs):
+    transaction.on_commit(lambda: delete_variants(instance))
+
+
+# Category.product_count is maintained incrementally. The category a product was loaded with is remembered
+# (Product.from_db) so a save that moves it to another category can move the count too. It is looked up when the
+# product wasn't loaded with it: category deferred, or an instance built with the pk of an existing row.
+@receiver(pre_save, sender=Product)
+def fetch_product_category(sender, instance, **kwargs):
+    if getattr(instance, '_loaded_category_id', None) is None and instance.pk is not None:
+        instance._loaded_category_id = Product.objects.filter(pk=instance.pk).values_list('category_id', flat=True).first()
+
+
+@receiver(post_save, sender=Product)
+def update_category_count_on_save(sender, instance, created, **kwargs):
+    if created:
+        Category.objects.filter(pk=instance.category_id).update(product_count=F('product_count') + 1, last_updated=Now())
+    elif instance._loaded_category_id != instance.category_id:
+        Category.objects.filter(pk=instance._loaded_category_id, product_count__gt=0).update(product_count=F('product_count') - 1, last_updated=Now())
+        Category.objects.filter(pk=instance.category_id).update(product_count=F('product_count') + 1, last_updated=Now())
+    instance._loaded_category_id = instance.category_id
+
+
+@receiver(post_delete, sender=Product)
+def update_category_count_on_delete(sender, instance, **kwargs):
+    Category.objects.filter(pk=instance.category_id, product_count__gt=0).update(product_count=F('product_count') - 1, last_updated=Now())
@@ -1,3 +1,1162 @@
-from django.test import TestCase
+import datetime
+import json
+import tempfile
+import threading
+import time
+from base64 import urlsafe_b64encode
+from contextlib import contextmanager
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
+from uuid import uuid4
 
-# Create your tests here.
+from django.apps import apps
+from django.core.management import CommandError, call_command
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.db.models.signals import post_init
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import background, events, renderers
+from .authentication import CachedJWTAuthentication, user_cache_key
+from .caching import cache_version, shared_cache
+from .inventory import add_stock, available_stock, shard_stock
+from .onboarding import create_missing_customers
+from .models import Cart, CartItem, Category, Customer, Order, OrderEvent, OrderItem, Product, ProductImage, Review, User
+from .pagination import ProductPagination
+from .permissions import PERMISSIONS_VERSION_KEY
+from .search import search_index_missing
+from .serializers import BulkCartItemListSerializer, CreateOrderSerializer, OrderSerializer, ProductSerializer
+from .signals import restore_search_index
+from .uploads import MULTIPART_OVERHEAD
+from .validators import MAX_IMAGE_SIZE_KB
+
+
+class ProductListQueryCountTests(APITestCase):
+    # The product list must cost the same number of queries whatever the page size and however many
+    # images each product has: no query per product, no query per image.
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        category = Category.objects.create(title='Phones')
+        cls.products = [
+            Product.objects.create(title=f'Phone {i}', description='A phone', price=5000 + i, category=category)
+            for i in range(12)
+        ]
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def get_page(self, page_size):
+        with mock.patch.object(ProductPagination, 'page_size', page_size):
+            response = self.client.get('/store/products/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), page_size)
+        return response
+
+    def test_constant_queries_per_page(self):
+        # conditional GET aggregate (per-process cache), COUNT(*), the page, the page's images
+        images_per_product = 0
+        for extra_images in [0, 1, 2]:
+            ProductImage.objects.bulk_create(ProductImage(product=product) for product in self.products for _ in range(extra_images))
+            images_per_product += extra_images
+            for page_size in [1, 5, len(self.products)]:
+                with self.subTest(images_per_product=images_per_product, page_size=page_size):
+                    with self.assertNumQueries(4):
+                        response = self.get_page(page_size)
+                    self.assertTrue(all(len(product['image']) == images_per_product for product in response.data['results']))
+
+
+class ValuesSerializerTests(APITestCase):
+    # The .values() list serializers (store/readonly.py) must render the document their ModelSerializer would
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        category = Category.objects.create(title='Phones')
+        cls.products = [
+            Product.objects.create(title=f'Phone {i}', description='A phone', price=Decimal('5000.33') + i, category=category)
+            for i in range(3)
+        ]
+        ProductImage.objects.create(product=cls.products[0], image='store/image/a.png')
+        ProductImage.objects.create(product=cls.products[0], image='store/image/b.png', variants={'card': {'jpeg': 'card/b.jpeg', 'webp': 'card/b.webp'}})
+        customer = Customer.objects.get(user=cls.user)
+        cls.order = Order.objects.create(customer=customer)
+        OrderItem.objects.bulk_create(OrderItem(order=cls.order, product=product, quantity=2, price=product.price) for product in cls.products)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def assertSameDocuments(self, rows, expected):
+        self.assertEqual(JSONRenderer().render(rows), JSONRenderer().render(expected))
+
+    def test_product_list_matches_product_serializer(self):
+        response = self.client.get('/store/products/?ordering=price')
+        self.assertEqual(response.status_code, 200)
+        context = {'request': response.wsgi_request, 'image_variant': 'card'}
+        self.assertSameDocuments(response.data['results'], ProductSerializer(self.products, many=True, context=context).data)
+
+    def test_order_list_matches_order_serializer(self):
+        response = self.client.get('/store/orders/')
+        self.assertEqual(response.status_code, 200)
+        self.assertSameDocuments(response.data['results'], OrderSerializer([self.order], many=True).data)
+
+    def test_retrieve_queries_are_fixed(self):
+        # conditional GET aggregate (per-process cache), the product and its images
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/store/products/{self.products[0].pk}/')
+        self.assertEqual(len(response.data['image']), 2)
+        # the order and its items with their products and categories
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/store/orders/{self.order.pk}/')
+        self.assertEqual(len(response.data['items']), 3)
+
+
+class TamperedCursorTests(APITestCase):
+    # Keyset cursors are base64 JSON a client can edit: anything that doesn't fit the ordering fields is a 404
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        category = Category.objects.create(title='Phones')
+        cls.product = Product.objects.create(title='Phone', description='A phone', price=5000, category=category)
+        Review.objects.create(product=cls.product, reviewer_name='Ada', remark='Fine')
+
+    def setUp(self):
+        # a real token, the async views authenticate on their own
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(self.user)}')
+        cache.clear()
+
+    def cursor(self, position):
+        return urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    def test_tampered_cursors_are_not_found(self):
+        endpoints = {
+            '/store/products/?ordering=price': 2,
+            '/store/async/products/?ordering=price': 2,
+            f'/store/products/{self.product.pk}/reviews/?': 2,
+            f'/store/async/products/{self.product.pk}/reviews/?': 2,
+            '/store/orders/?': 2,
+            '/store/customers/?': 3,
+        }
+        for url, length in endpoints.items():
+            for value in ['x', [1], {'a': 1}, None]:
+                with self.subTest(url=url, value=value):
+                    response = self.client.get(f'{url}&cursor={self.cursor([value] * length)}')
+                    self.assertEqual(response.status_code, 404)
+                    self.assertEqual(response.json(), {'detail': 'Invalid cursor'})
+
+    def test_next_link_round_trip(self):
+        Product.objects.bulk_create(
+            Product(title=f'Phone {i}', description='A phone', price=5001 + i, category=self.product.category) for i in range(6)
+        )
+        response = self.client.get('/store/products/?pagination=cursor&ordering=price')
+        self.assertEqual(response.status_code, 200)
+        first = [product['id'] for product in response.data['results']]
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.status_code, 200)
+        second = [product['id'] for product in response.data['results']]
+        self.assertEqual(len(first + second), 7)
+        self.assertFalse(set(first) & set(second))
+
+
+@skipUnless(renderers.orjson, 'orjson is not installed')
+class RendererTests(APITestCase):
+    # ORJSONRenderer is a drop-in: the bytes are DRF's JSONRenderer's
+    def assertSameJSON(self, data, media_type=None):
+        self.assertEqual(renderers.ORJSONRenderer().render(data, media_type), JSONRenderer().render(data, media_type))
+
+    def test_types_render_like_drf(self):
+        values = {
+            'datetime': timezone.now(),
+            'naive datetime': datetime.datetime(2020, 1, 2, 3, 4, 5, 123456),
+            'offset datetime': datetime.datetime(2020, 1, 2, 3, 4, 5, tzinfo=datetime.timezone(datetime.timedelta(hours=2))),
+            'date': datetime.date(2020, 1, 2),
+            'time': datetime.time(3, 4, 5, 123456),
+            'timedelta': datetime.timedelta(seconds=90),
+            'decimal': Decimal('12.50'),
+            'uuid': uuid4(),
+            'lazy': gettext_lazy('Invalid cursor'),
+            'unicode': 'caf\xe9 \u2028 \u2029 \U0001f600',
+            'bytes': b'abc',
+            'nested': {'list': [1, 1.5, None, True], 2: 'int key'},
+            'set': {1},
+        }
+        for name, value in values.items():
+            with self.subTest(name):
+                self.assertSameJSON({name: value})
+        self.assertSameJSON({'a': [1, {'b': 2}]}, 'application/json; indent=2')
+        self.assertEqual(renderers.ORJSONRenderer().render(None), JSONRenderer().render(None))
+        # exponent floats are spelled differently, but are the same numbers
+        floats = [1e20, 1.5e-7]
+        self.assertEqual(json.loads(renderers.ORJSONRenderer().render(floats)), json.loads(JSONRenderer().render(floats)))
+
+    def test_api_responses_render_like_drf(self):
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        category = Category.objects.create(title='Phones')
+        product = Product.objects.create(title='Phone \u2014 \xe9dition', description='A phone', price=Decimal('5000.50'), category=category)
+        Review.objects.create(product=product, reviewer_name='Ada', remark='Fine')
+        self.client.force_authenticate(user)
+        for url in ['/store/products/', f'/store/products/{product.pk}/', f'/store/products/{product.pk}/reviews/', '/store/orders/']:
+            with self.subTest(url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertSameJSON(response.data)
+
+
+class ReviewTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        category = Category.objects.create(title='Phones')
+        cls.product = Product.objects.create(title='Phone', description='A phone', price=5000, category=category)
+        cls.reviews = [Review.objects.create(product=cls.product, reviewer_name=f'Reader {i}', remark='Fine') for i in range(3)]
+
+    def setUp(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(self.user)}')
+        cache.clear()
+
+    def test_product_is_embedded_once_per_page(self):
+        for url in [f'/store/products/{self.product.pk}/reviews/', f'/store/async/products/{self.product.pk}/reviews/']:
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                reviews = response.json()['results']
+                self.assertEqual(len(reviews), 3)
+                self.assertEqual({review['product']['title'] for review in reviews}, {'Phone'})
+                self.assertEqual(len([query for query in queries if 'FROM "store_product"' in query['sql']]), 1)
+
+    def test_unknown_product_has_no_reviews(self):
+        for url in ['/store/products/0/reviews/', '/store/async/products/0/reviews/']:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()['results'], [])
+
+    def test_writes_do_not_load_the_product_page(self):
+        url = f'/store/products/{self.product.pk}/reviews/'
+        response = self.client.post(url, {'reviewer_name': 'Ada', 'remark': 'Great'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['product']['id'], self.product.pk)  # the new review's own product
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.post(url, {'remark': 'No name'}, format='json').status_code, 400)
+        self.assertFalse([query['sql'] for query in queries if 'FROM "store_product"' in query['sql']])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'reads PostgreSQL EXPLAIN ANALYZE output')
+class KeysetPlanTests(APITestCase):
+    # A deep cursor page must start the index scan at the cursor (an Index Cond), not read every row
+    # before it and throw them away (a Filter with a large "Rows Removed by Filter").
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.buyer = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        category = Category.objects.create(title='Phones')
+        Product.objects.bulk_create(
+            Product(title=f'Phone {i}', description='A phone', price=1000 + i % 700, category=category) for i in range(3000)
+        )
+        cls.product = Product.objects.first()
+        Review.objects.bulk_create(Review(product=cls.product, reviewer_name=f'Reader {i}', remark='Fine') for i in range(3000))
+        buyer = Customer.objects.get(user=cls.buyer)
+        others = Customer.objects.bulk_create(Customer(first_name=f'Name {i % 300}', last_name=f'Last {i}') for i in range(3000))
+        Order.objects.bulk_create(Order(customer=buyer if i % 2 else others[i // 2]) for i in range(6000))
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+        cache.clear()
+
+    def cursor(self, position):
+        return urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    def page_plan(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        page = next(query['sql'] for query in queries.captured_queries if 'ORDER BY' in query['sql'] and ' LIMIT ' in query['sql'])
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN ANALYZE {page}')
+            return '\n'.join(row[0] for row in cursor.fetchall())
+
+    def test_deep_product_page_is_an_index_range(self):
+        last = Product.objects.order_by('price', 'id')[2500]
+        for ordering, operator in [('price', '>'), ('-price', '<')]:
+            with self.subTest(ordering=ordering):
+                plan = self.page_plan(f'/store/products/?ordering={ordering}&cursor={self.cursor([str(last.price), last.id])}')
+                self.assertRegex(plan, rf'Index Cond: \(ROW\(price, id\) {operator} ROW\(')
+                self.assertNotIn('Rows Removed by Filter', plan)
+
+    def test_deep_review_order_and_customer_pages_are_index_ranges(self):
+        review = Review.objects.filter(product=self.product).order_by('-posted_at', '-id')[2500]
+        order = Order.objects.order_by('-placed_at', '-id')[5000]
+        own_order = Order.objects.filter(customer__user=self.buyer).order_by('-placed_at', '-id')[2500]
+        customer = Customer.objects.order_by('first_name', 'last_name', 'id')[2500]
+        pages = {
+            'reviews': (self.user, f'/store/products/{self.product.pk}/reviews/',
+                        [review.posted_at.isoformat(), review.id], r'ROW\(posted_at, id\) < ROW\('),
+            'staff orders': (self.user, '/store/orders/', [order.placed_at.isoformat(), order.id], r'ROW\(placed_at, id\) < ROW\('),
+            'own orders': (self.buyer, '/store/orders/', [own_order.placed_at.isoformat(), own_order.id], r'ROW\(placed_at, id\) < ROW\('),
+            'customers': (self.user, '/store/customers/',
+                          [customer.first_name, customer.last_name, customer.id], r'ROW\(\(first_name\)::text, \(last_name\)::text, id\) > ROW\('),
+        }
+        for name, (user, url, position, condition) in pages.items():
+            with self.subTest(name):
+                self.client.force_authenticate(user)
+                plan = self.page_plan(f'{url}?cursor={self.cursor(position)}')
+                self.assertRegex(plan, rf'Index Cond: .*{condition}')
+                self.assertNotIn('Rows Removed by Filter', plan)
+
+
+@contextmanager
+def shared_cache_settings():
+    # a cache every process sees (a directory here, Redis in production), so the caches gated on shared_cache() are used
+    with tempfile.TemporaryDirectory() as location, override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location,
+    }}):
+        yield
+
+
+def run_concurrently(function, calls):
+    # One thread, and so one database connection, per call; a barrier releases them together.
+    # Returns what each call returned (or raised), in order.
+    barrier = threading.Barrier(len(calls))
+    results = [None] * len(calls)
+
+    def run(index, args):
+        try:
+            barrier.wait()
+            results[index] = function(*args)
+        except Exception as exc:
+            results[index] = exc
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=run, args=(index, args)) for index, args in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class AddCartItemTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('ada', 'ada@example.com', 'password')
+        category = Category.objects.create(title='Phones')
+        cls.product = Product.objects.create(title='Phone', description='A phone', price=5000, category=category)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+        self.cart = Cart.objects.create()
+
+    def add(self, product_id, quantity, cart_id=None):
+        return self.client.post(f'/store/carts/{cart_id or self.cart.id}/items/', {'product_id': product_id, 'quantity': quantity}, format='json')
+
+    def test_repeated_adds_sum_quantities(self):
+        first = self.add(self.product.pk, 2)
+        second = self.add(self.product.pk, 3)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.data, {'id': first.data['id'], 'product_id': self.product.pk, 'quantity': 5})
+        self.assertEqual(list(CartItem.objects.filter(cart=self.cart).values_list('product_id', 'quantity')), [(self.product.pk, 5)])
+
+    def test_unknown_product(self):
+        response = self.add(self.product.pk + 1000, 1)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'product_id': ['Sorry bros the items youa re trying to fetch is not in the DB']})
+        # an unknown cart too: the product error wins, as when validate_product_id ran first
+        response = self.add(self.product.pk + 1000, 1, cart_id=uuid4())
+        self.assertEqual(response.json(), {'product_id': ['Sorry bros the items youa re trying to fetch is not in the DB']})
+
+    def test_unknown_cart(self):
+        response = self.add(self.product.pk, 1, cart_id=uuid4())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), ['Invalid cart is supplied'])
+        self.assertFalse(CartItem.objects.exists())
+
+
+class BulkCartItemTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('ada', 'ada@example.com', 'password')
+        category = Category.objects.create(title='Phones')
+        cls.products = [Product.objects.create(title=f'Phone {i}', description='A phone', price=5000 + i, category=category) for i in range(3)]
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+        self.cart = Cart.objects.create()
+
+    def bulk(self, items):
+        return self.client.post(f'/store/carts/{self.cart.id}/items/bulk/', items, format='json')
+
+    def lines(self):
+        return dict(CartItem.objects.filter(cart=self.cart).values_list('product_id', 'quantity'))
+
+    def test_listed_quantities_replace_the_cart_lines(self):
+        first, second, third = self.products
+        CartItem.objects.create(cart=self.cart, product=first, quantity=5)
+        CartItem.objects.create(cart=self.cart, product=third, quantity=1)
+        response = self.bulk([
+            {'product_id': first.pk, 'quantity': 2},
+            {'product_id': second.pk, 'quantity': 1},
+            {'product_id': second.pk, 'quantity': 2},  # listed twice: added up
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.lines(), {first.pk: 2, second.pk: 3, third.pk: 1})  # unlisted lines are kept
+        self.assertEqual(response.data['grand_total'], 2 * first.price + 3 * second.price + third.price)
+
+    def test_validation_is_two_queries(self):
+        # the cart, then every product id in one IN query, however long the list
+        for count in [1, 3]:
+            with self.subTest(count=count):
+                items = [{'product_id': product.pk, 'quantity': 1} for product in self.products[:count]] + [{'product_id': 0, 'quantity': 1}]
+                with self.assertNumQueries(2):
+                    response = self.bulk(items)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'non_field_errors': ['These products are not in the DB: [0]']})
+                self.assertEqual(self.lines(), {})
+
+    def test_cart_deleted_after_validation(self):
+        validate = BulkCartItemListSerializer.validate
+
+        def validate_then_checkout(serializer, items):
+            items = validate(serializer, items)
+            Cart.objects.filter(pk=self.cart.pk).delete()  # e.g. a checkout of the same cart finishing meanwhile
+            return items
+
+        with mock.patch.object(BulkCartItemListSerializer, 'validate', validate_then_checkout):
+            response = self.bulk([{'product_id': self.products[0].pk, 'quantity': 1}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), ['Invalid cart is supplied'])
+        self.assertFalse(CartItem.objects.exists())
+
+
+class CartTotalTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('ada', 'ada@example.com', 'password')
+        category = Category.objects.create(title='Phones')
+        cls.products = [Product.objects.create(title=f'Phone {i}', description='A phone', price=price, category=category)
+                        for i, price in enumerate(['19.99', '5.05', '100.10'])]
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+        self.cart = Cart.objects.create()
+
+    def test_totals_are_computed_by_the_database(self):
+        for product, quantity in zip(self.products, [3, 1, 2]):
+            CartItem.objects.create(cart=self.cart, product=product, quantity=quantity)
+        # the cart with its total, its lines with their products and totals
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/store/carts/{self.cart.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['grand_total'], Decimal('265.22'))
+        self.assertEqual(sorted(item['sub_total'] for item in response.data['items']), [Decimal('5.05'), Decimal('59.97'), Decimal('200.20')])
+
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/store/carts/{self.cart.id}/summary/')
+        self.assertEqual(response.data, {'id': self.cart.id, 'item_count': 6, 'grand_total': Decimal('265.22')})
+
+    def test_empty_and_unknown_carts(self):
+        self.assertEqual(self.client.get(f'/store/carts/{self.cart.id}/').data['grand_total'], Decimal('0'))
+        self.assertEqual(self.client.get(f'/store/carts/{self.cart.id}/summary/').data,
+                         {'id': self.cart.id, 'item_count': 0, 'grand_total': Decimal('0')})
+        self.assertEqual(self.client.get(f'/store/carts/{uuid4()}/summary/').status_code, 404)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs concurrent writers, SQLite has one at a time')
+class ConcurrentAddCartItemTests(TransactionTestCase):
+    def test_concurrent_adds_lose_no_increment(self):
+        user = User.objects.create_user('ada', 'ada@example.com', 'password')
+        category = Category.objects.create(title='Phones')
+        products = [Product.objects.create(title=f'Phone {i}', description='A phone', price=5000, category=category) for i in range(2)]
+        cart = Cart.objects.create()
+
+        def add(product_id, quantity):
+            client = APIClient()
+            client.force_authenticate(user)
+            return client.post(f'/store/carts/{cart.id}/items/', {'product_id': product_id, 'quantity': quantity}, format='json').status_code
+
+        # 40 requests at once, half of them racing to create each line
+        results = run_concurrently(add, [(products[i % 2].pk, 1 + i % 3) for i in range(40)])
+        self.assertEqual(results, [201] * 40)
+        expected = {product.pk: sum(1 + i % 3 for i in range(40) if i % 2 == index) for index, product in enumerate(products)}
+        self.assertEqual(dict(CartItem.objects.filter(cart=cart).values_list('product_id', 'quantity')), expected)
+
+
+class CustomerTests(APITestCase):
+    # Customer keeps copies of its user's names for sorting; /customers/me/ looks the customer up by user_id
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('ada', 'ada@example.com', 'password', first_name='Ada', last_name='Lovelace')
+        User.objects.create_user('alan', 'alan@example.com', 'password', first_name='Alan', last_name='Turing')
+        User.objects.create_user('grace', 'grace@example.com', 'password', first_name='Ada', last_name='Byron')
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+        cache.clear()
+
+    def test_user_names_reach_the_customer(self):
+        self.user.first_name = 'Augusta'
+        self.user.save()
+        self.assertEqual(Customer.objects.values_list('first_name', 'last_name').get(user=self.user), ('Augusta', 'Lovelace'))
+        with CaptureQueriesContext(connection) as queries:
+            self.user.save(update_fields=['last_login'])
+        self.assertFalse([query for query in queries if '"store_customer"' in query['sql']])
+
+    def test_missing_customers_copy_the_names(self):
+        Customer.objects.filter(user=self.user).delete()
+        self.assertEqual(create_missing_customers(User.objects.all()), 1)
+        self.assertEqual(Customer.objects.values_list('first_name', 'last_name').get(user=self.user), ('Ada', 'Lovelace'))
+
+    def test_list_is_sorted_by_name_without_a_join(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/store/customers/')
+        self.assertEqual(response.status_code, 200)
+        users = dict(Customer.objects.values_list('id', 'user__username'))
+        self.assertEqual([users[customer['id']] for customer in response.data['results']], ['grace', 'ada', 'alan'])
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('JOIN', queries[0]['sql'])
+
+    def test_me(self):
+        response = self.client.get('/store/customers/me/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['user_id'], self.user.pk)
+        Customer.objects.filter(user=self.user).update(membership=Customer.Gold)  # no signal, like a change made by another worker
+        self.assertEqual(self.client.get('/store/customers/me/').data['membership'], Customer.Gold)
+        Customer.objects.filter(user=self.user).delete()
+        self.assertEqual(self.client.get('/store/customers/me/').status_code, 404)
+
+    @shared_cache_settings()
+    def test_me_is_cached_until_the_customer_changes(self):
+        self.user.is_staff = True  # CustomerViewSet.get_permissions() keeps writes to staff
+        self.assertEqual(self.client.get('/store/customers/me/').status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/store/customers/me/').status_code, 200)
+        response = self.client.put('/store/customers/me/', {'membership': Customer.Gold}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/store/customers/me/').data['membership'], Customer.Gold)
+
+
+class OnboardingTests(APITestCase):
+    def import_csv(self, content):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8') as csv_file:
+            csv_file.write(content)
+            csv_file.flush()
+            out = StringIO()
+            call_command('import_users', csv_file.name, stdout=out)
+        return out.getvalue()
+
+    def test_registration_creates_one_customer(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/auth/users/', {
+                'username': 'ada', 'email': 'ada@example.com', 'password': 'a-long-password-1', 'first_name': 'Ada', 'last_name': 'Lovelace',
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        customers = Customer.objects.filter(user_id=response.data['id'])
+        self.assertEqual(list(customers.values_list('first_name', 'last_name')), [('Ada', 'Lovelace')])
+        inserts = [query['sql'] for query in queries if query['sql'].startswith('INSERT INTO "store_customer"')]
+        self.assertEqual(len(inserts), 1)
+
+    def test_import_creates_users_with_customers(self):
+        output = self.import_csv('username,email,first_name,password_hash\nada,ada@example.com,Ada,\nbob,bob@example.com,,md5$x$y\n')
+        self.assertIn('Imported 2 users with their customers', output)
+        self.assertEqual(dict(Customer.objects.values_list('user__username', 'first_name')), {'ada': 'Ada', 'bob': ''})
+        self.assertFalse(User.objects.get(username='ada').has_usable_password())
+        self.assertEqual(User.objects.get(username='bob').password, 'md5$x$y')
+
+    def test_rows_without_required_values_import_nothing(self):
+        for content, message in [
+            ('username,email\nada,ada@example.com\nbob,\n', 'Row 3: missing email'),
+            ('username,email\nada,ada@example.com\n\n,bob@example.com\n', 'Row 4: missing username'),
+            ('username,email\nada\n', 'Row 2: missing email'),
+            ('username\nada\n', 'Missing columns: email'),
+        ]:
+            with self.subTest(message):
+                with self.assertRaisesMessage(CommandError, message):
+                    self.import_csv(content)
+                self.assertFalse(User.objects.exists())
+
+
+class PurgeAbandonedCartsTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Phones')
+        products = [Product.objects.create(title=f'Phone {i}', description='A phone', price=5000 + i, category=category) for i in range(5)]
+        carts = [Cart.objects.create() for _ in range(5)]
+        CartItem.objects.bulk_create(CartItem(cart=cart, product=product, quantity=1) for cart in carts for product in products)
+        cls.old = [cart.pk for cart in carts[:3]]
+        Cart.objects.filter(pk__in=cls.old).update(placed_at=timezone.now() - datetime.timedelta(days=40))
+
+    def purge(self, *args):
+        out = StringIO()
+        call_command('purge_abandoned_carts', '--sleep', '0', *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_deletes_nothing(self):
+        self.assertIn('3 carts older than 30 days', self.purge('--dry-run'))
+        self.assertEqual(Cart.objects.count(), 5)
+
+    def test_old_carts_and_items_go_in_bounded_batches(self):
+        with CaptureQueriesContext(connection) as queries:
+            output = self.purge('--batch-size', '2')
+        self.assertIn('Deleted 3 carts and 15 cart items', output)
+        self.assertFalse(Cart.objects.filter(pk__in=self.old).exists())
+        self.assertEqual(Cart.objects.count(), 2)
+        self.assertEqual(CartItem.objects.count(), 10)
+
+        # 10 items in the first batch of 2 carts, 5 in the second, deleted 2 at a time
+        deletes = [query['sql'] for query in queries if query['sql'].startswith('DELETE FROM "store_cartitem" WHERE "store_cartitem"."id" IN')]
+        self.assertEqual(len(deletes), 8)
+        self.assertTrue(all(sql.count(',') < 2 for sql in deletes))
+
+
+class SearchIndexTests(APITestCase):
+    def test_migrate_restores_dropped_search_trigger(self):
+        # what SQLite does to the FTS5 triggers when a migration rebuilds store_product
+        drop = {
+            'postgresql': 'DROP TRIGGER store_product_search_document ON store_product',
+            'sqlite': 'DROP TRIGGER store_product_fts_insert',
+        }[connection.vendor]
+        with connection.cursor() as cursor:
+            cursor.execute(drop)
+        self.assertTrue(search_index_missing(connection))
+        category = Category.objects.create(title='Phones')
+        Product.objects.create(title='Walkie talkie', description='Two way radio', price=5000, category=category)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')  # the test transaction's pending FK checks would block CREATE INDEX
+
+        restore_search_index(sender=apps.get_app_config('store'), using=connection.alias, apps=apps)
+
+        self.assertFalse(search_index_missing(connection))
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get('/store/products/?search=radio')
+        self.assertEqual([product['title'] for product in response.data['results']], ['Walkie talkie'])
+
+
+class PermissionCacheTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('ada', 'ada@example.com', 'password')
+        cls.view_product = Permission.objects.get(codename='view_product', content_type__app_label='store')
+        cls.user.user_permissions.add(cls.view_product)
+
+    def setUp(self):
+        # a token, so the user (and its permissions) are loaded per request like in production
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(self.user)}')
+        cache.clear()
+
+    def revoke_elsewhere(self):
+        # a change whose invalidation this process never sees, like one made by another worker
+        User.user_permissions.through.objects.filter(user=self.user, permission=self.view_product).delete()
+
+    def test_per_process_cache_checks_permissions_every_request(self):
+        self.assertFalse(shared_cache())
+        self.assertEqual(self.client.get('/store/products/').status_code, 200)
+        self.revoke_elsewhere()
+        self.assertEqual(self.client.get('/store/products/').status_code, 403)
+
+    def test_shared_cache_is_used_and_invalidated(self):
+        with shared_cache_settings():
+            self.assertTrue(shared_cache())
+            self.assertEqual(self.client.get('/store/products/').status_code, 200)
+            self.assertIn('store.view_product', cache.get(f'store:perms:{cache_version(PERMISSIONS_VERSION_KEY)}:{self.user.pk}'))
+            self.user.user_permissions.remove(self.view_product)  # m2m_changed bumps the version
+            self.assertEqual(self.client.get('/store/products/').status_code, 403)
+
+
+class AuthenticationCacheTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('ada', 'ada@example.com', 'password', first_name='Ada')
+        cls.user.user_permissions.add(Permission.objects.get(codename='view_product', content_type__app_label='store'))
+
+    def setUp(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(self.user)}')
+        cache.clear()
+
+    def user_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in queries if f'FROM "{User._meta.db_table}"' in query['sql']]
+
+    @shared_cache_settings()
+    def test_cache_holds_no_password_and_saves_the_user_query(self):
+        self.user_queries('/auth/users/me/')
+        cached = cache.get(user_cache_key(self.user.pk))
+        self.assertEqual(cached, {'id': self.user.pk, 'username': 'ada', 'is_active': True, 'is_staff': False, 'is_superuser': False})
+        self.assertNotIn(self.user.password, repr(cached))
+
+        self.user_queries('/store/products/')  # fills the permission cache
+        response, queries = self.user_queries('/store/products/')
+        self.assertEqual(queries, [])
+
+        # the fields that aren't cached are deferred: they are read when used, and right
+        response, queries = self.user_queries('/auth/users/me/')
+        self.assertEqual((response.data['email'], response.data['first_name']), ('ada@example.com', 'Ada'))
+        self.assertTrue(queries)
+        self.assertFalse([query for query in queries if '"password"' in query])
+
+    @shared_cache_settings()
+    def test_saving_the_user_drops_the_entry(self):
+        self.user_queries('/auth/users/me/')
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+        self.assertEqual(self.client.get('/auth/users/me/').status_code, 401)
+
+    @shared_cache_settings()
+    def test_saving_a_cached_user_keeps_the_other_fields(self):
+        self.user_queries('/auth/users/me/')
+        user = CachedJWTAuthentication().get_user(AccessToken.for_user(self.user))
+        user.is_staff = True
+        user.save()
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_staff)
+        self.assertTrue(self.user.check_password('password'))
+        self.assertEqual((self.user.email, self.user.first_name), ('ada@example.com', 'Ada'))
+
+
+class CatalogueCacheTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        category = Category.objects.create(title='Phones')
+        cls.product = Product.objects.create(title='Phone', description='A phone', price=5000, category=category)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+        cache.clear()
+
+    def reprice_elsewhere(self, price):
+        # a change whose invalidation this process never sees, like one made by another worker
+        Product.objects.filter(pk=self.product.pk).update(price=price)
+
+    def test_per_process_cache_is_not_used(self):
+        self.assertFalse(shared_cache())
+        self.client.get(f'/store/products/{self.product.pk}/')
+        self.reprice_elsewhere(4000)
+        self.assertEqual(self.client.get(f'/store/products/{self.product.pk}/').data['price'], Decimal('4000.00'))
+
+    @shared_cache_settings()
+    def test_shared_cache_is_used_and_invalidated(self):
+        url = f'/store/products/{self.product.pk}/'
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).data['price'], Decimal('5000.00'))
+        product = Product.objects.get(pk=self.product.pk)
+        product.price = 4000
+        product.save()  # the post_save signal bumps the catalogue version
+        self.assertEqual(self.client.get(url).data['price'], Decimal('4000.00'))
+
+
+class ConditionalGetTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.categories = [Category.objects.create(title=title) for title in ['Phones', 'Laptops']]
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+        cache.clear()
+
+    def test_list_deletion_is_not_reported_unmodified(self):
+        response = self.client.get('/store/category/')
+        self.assertNotIn('Last-Modified', response)  # a deletion wouldn't move it
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/store/category/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.categories[1].delete()
+        for headers in [{'HTTP_IF_NONE_MATCH': etag}, {'HTTP_IF_MODIFIED_SINCE': http_date(time.time() + 60)}]:
+            with self.subTest(headers=headers):
+                response = self.client.get('/store/category/', **headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual([category['title'] for category in response.data], ['Phones'])
+
+    def test_detail_last_modified(self):
+        response = self.client.get(f'/store/category/{self.categories[0].pk}/')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(f'/store/category/{self.categories[0].pk}/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_per_process_product_etag_sees_changes_elsewhere(self):
+        category = Category.objects.create(title='Laptops')
+        product = Product.objects.create(title='Laptop', description='A laptop', price=5000, category=category)
+        for url in ['/store/products/', f'/store/products/{product.pk}/']:
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                # another worker's change: this process's catalogue version doesn't move
+                Product.objects.filter(pk=product.pk).update(price=F('price') + 1, last_updated=timezone.now())
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    @shared_cache_settings()
+    def test_product_validators_cost_no_query(self):
+        category = Category.objects.create(title='Laptops')
+        products = [Product.objects.create(title=f'Laptop {i}', description='A laptop', price=5000 + i, category=category) for i in range(7)]
+        self.client.get('/store/products/')
+        with self.assertNumQueries(0):  # a cache hit
+            response = self.client.get('/store/products/')
+        self.assertNotIn('Last-Modified', response)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/store/products/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        with CaptureQueriesContext(connection) as queries:  # no COUNT(*) on keyset pages
+            response = self.client.get('/store/products/?pagination=cursor')
+            self.client.get(response.data['next'])
+        self.assertFalse([query['sql'] for query in queries if 'COUNT(' in query['sql'].upper()])
+
+        etag = self.client.get('/store/products/').get('ETag')
+        products[0].delete()
+        for headers in [{'HTTP_IF_NONE_MATCH': etag}, {'HTTP_IF_MODIFIED_SINCE': http_date(time.time() + 60)}]:
+            with self.subTest(headers=headers):
+                response = self.client.get('/store/products/', **headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.data['count'], 6)
+
+
+class ImageUploadTests(APITestCase):
+    # store/uploads.py refuses oversized and non-image uploads while the body streams in, before anything is saved
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        category = Category.objects.create(title='Phones')
+        cls.product = Product.objects.create(title='Phone', description='A phone', price=5000, category=category)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def upload(self, content, name='phone.png'):
+        with override_settings(MEDIA_ROOT=tempfile.mkdtemp()):
+            return self.client.post(f'/store/products/{self.product.pk}/images/',
+                                    {'image': SimpleUploadedFile(name, content, 'image/png')}, format='multipart')
+
+    def test_oversized_uploads_are_413(self):
+        too_large = MAX_IMAGE_SIZE_KB * 1024 + 1
+        cases = {
+            too_large: f'phone.png is larger than {MAX_IMAGE_SIZE_KB}KB.',  # caught while streaming
+            too_large + MULTIPART_OVERHEAD: f'Upload is larger than {MAX_IMAGE_SIZE_KB}KB.',  # from Content-Length
+        }
+        for size, detail in cases.items():
+            with self.subTest(size=size):
+                response = self.upload(b'\x89PNG\r\n\x1a\n' + b'0' * size)
+                self.assertEqual(response.status_code, 413)
+                self.assertEqual(response.data, {'detail': detail})
+        self.assertFalse(ProductImage.objects.exists())
+
+    def test_wrong_signature_is_400(self):
+        for content in [b'GIF89a' + b'0' * 100, b'\xff\xd8']:
+            with self.subTest(content=content[:6]):
+                response = self.upload(content)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.data, {'image': ['phone.png is not a PNG or JPEG image.']})
+        self.assertFalse(ProductImage.objects.exists())
+
+
+class BackgroundTests(TransactionTestCase):
+    def test_jobs_run_and_failures_are_logged(self):
+        category = Category.objects.create(title='Phones')
+        self.assertEqual(background.submit('test', 1, lambda: Category.objects.get(pk=category.pk).title).result(), 'Phones')
+
+        def fail():
+            raise RuntimeError('boom')
+
+        with self.assertLogs('store.background', 'ERROR') as logs:
+            self.assertIsNone(background.submit('test', 1, fail).result())
+        self.assertIn('Background job test (fail) failed', logs.output[0])
+
+
+class OrderQueryCountTests(APITestCase):
+    # Order history and checkout cost the same number of queries however many orders and items there are
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        cls.customer = Customer.objects.get(user=cls.user)
+        category = Category.objects.create(title='Phones')
+        cls.products = [Product.objects.create(title=f'Phone {i}', description='A phone', price=5000 + i, category=category) for i in range(20)]
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def place_order(self, items):
+        order = Order.objects.create(customer=self.customer)
+        OrderItem.objects.bulk_create(OrderItem(order=order, product=product, quantity=1, price=product.price) for product in self.products[:items])
+
+    def test_list_queries_are_fixed(self):
+        # the page, its items with their products
+        for orders, items in [(1, 1), (5, 20)]:
+            with self.subTest(orders=orders, items=items):
+                for _ in range(orders):
+                    self.place_order(items)
+                with self.assertNumQueries(2):
+                    response = self.client.get('/store/orders/')
+                self.assertEqual(len(response.data['results'][0]['items']), items)
+
+    def test_create_reloads_the_order_in_fixed_queries(self):
+        for items in [1, 20]:
+            with self.subTest(items=items):
+                cart = Cart.objects.create()
+                CartItem.objects.bulk_create(CartItem(cart=cart, product=product, quantity=1) for product in self.products[:items])
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.post('/store/orders/', {'cart_id': str(cart.id)}, format='json')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['items']), items)
+                reads = [query['sql'] for query in queries if query['sql'].startswith('SELECT') and '"store_orderitem"' in query['sql']]
+                self.assertEqual(len(reads), 1)
+
+    def test_checkout_statements_are_fixed(self):
+        # cart check, cart lock, items with prices and stock, customer, order, order items, outbox event,
+        # cart and items delete (3), the reloaded order and its items; plus one stock UPDATE when stock is tracked
+        for stock, statements in [(None, 12), (100, 13)]:
+            Product.objects.filter(pk__in=[product.pk for product in self.products]).update(stock=stock)
+            for items in [1, 20]:
+                with self.subTest(stock=stock, items=items):
+                    cart = Cart.objects.create()
+                    CartItem.objects.bulk_create(CartItem(cart=cart, product=product, quantity=1) for product in self.products[:items])
+                    with CaptureQueriesContext(connection) as queries:
+                        response = self.client.post('/store/orders/', {'cart_id': str(cart.id)}, format='json')
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(len([query for query in queries if 'SAVEPOINT' not in query['sql']]), statements)
+
+
+class ProductCountTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones, cls.laptops = [Category.objects.create(title=title) for title in ['Phones', 'Laptops']]
+
+    def create(self, category):
+        return Product.objects.create(title='Item', description='An item', price=100, category=category)
+
+    def assertCounts(self, phones, laptops):
+        self.assertEqual(list(Category.objects.filter(pk__in=[self.phones.pk, self.laptops.pk]).order_by('title').values_list('product_count', flat=True)),
+                         [laptops, phones])
+        call_command('rebuild_product_counts', '--check', stdout=StringIO())  # CommandError on any drift
+
+    def test_count_follows_create_move_and_delete(self):
+        first = self.create(self.phones)
+        self.create(self.phones)
+        self.create(self.laptops)
+        self.assertCounts(phones=2, laptops=1)
+
+        product = Product.objects.get(pk=first.pk)
+        product.category = self.laptops
+        product.save()
+        self.assertCounts(phones=1, laptops=2)
+
+        product = Product.objects.only('title').get(pk=first.pk)  # loaded without its category: looked up on save
+        product.category = self.phones
+        product.save()
+        self.assertCounts(phones=2, laptops=1)
+
+        Product.objects.get(pk=first.pk).delete()
+        self.assertCounts(phones=1, laptops=1)
+        Product.objects.all().delete()
+        self.assertCounts(phones=0, laptops=0)
+
+    def test_loading_products_costs_no_signal(self):
+        self.assertFalse(post_init.has_listeners(Product))
+        self.create(self.phones)
+        product = Product.objects.get()
+        product.title = 'Renamed'
+        with self.assertNumQueries(1):  # the UPDATE, the category was loaded with the product
+            product.save()
+        self.assertCounts(phones=1, laptops=0)
+
+
+class StockTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(title='Phones')
+
+    def setUp(self):
+        self.product = Product.objects.create(title='Phone', description='A phone', price=5000, category=self.category, stock=1)
+
+    def checkout(self, quantity=1):
+        user = User.objects.create_user(f'user-{uuid4().hex[:8]}', f'{uuid4().hex[:8]}@example.com', 'password')
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product=self.product, quantity=quantity)
+        self.client.force_authenticate(user)
+        return self.client.post('/store/orders/', {'cart_id': str(cart.id)}, format='json')
+
+    @override_settings(STORE_EVENTS_BACKEND='sync')
+    def test_last_unit_sells_once(self):
+        self.assertEqual(self.checkout().status_code, 200)
+        response = self.checkout()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'cart_id': [f'Only 0 left of product {self.product.pk}']})
+        self.assertEqual(available_stock([self.product.pk]), {self.product.pk: 0})
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_save_does_not_drop_stock_changes(self):
+        product = Product.objects.get(pk=self.product.pk)
+        product.stock = 7
+        with self.assertRaises(ValueError):
+            product.save()
+        product.save(update_fields=['stock'])  # explicit, allowed
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 7)
+
+    def test_save_keeps_concurrent_stock_changes(self):
+        product = Product.objects.get(pk=self.product.pk)
+        add_stock(self.product.pk, 4)  # e.g. a restock while the admin form is open
+        product.title = 'Phone 2'
+        product.save()
+        self.assertEqual(Product.objects.values_list('title', 'stock').get(pk=self.product.pk), ('Phone 2', 5))
+
+    def test_save_of_deferred_product_loads_nothing(self):
+        product = Product.objects.defer('description', 'junk').get(pk=self.product.pk)
+        product.title = 'Phone 2'
+        with CaptureQueriesContext(connection) as queries:
+            product.save()
+        self.assertFalse([query['sql'] for query in queries.captured_queries if query['sql'].startswith('SELECT')])
+        self.assertEqual(Product.objects.values_list('title', 'description', 'stock').get(pk=self.product.pk), ('Phone 2', 'A phone', 1))
+
+    def test_save_of_deleted_product_inserts_it(self):
+        product = Product.objects.get(pk=self.product.pk)
+        Product.objects.filter(pk=self.product.pk).delete()
+        product.title = 'Phone 2'
+        product.save()
+        self.assertEqual(Product.objects.values_list('title', 'stock').get(pk=self.product.pk), ('Phone 2', 1))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs concurrent writers, SQLite has one at a time')
+@override_settings(STORE_EVENTS_BACKEND='sync')
+class ConcurrentCheckoutTests(TransactionTestCase):
+    def checkout_at_once(self, stock, carts, shards=0):
+        category = Category.objects.create(title='Phones')
+        product = Product.objects.create(title='Phone', description='A phone', price=5000, category=category, stock=stock)
+        shard_stock(product.pk, shards)
+        users = [User.objects.create_user(f'user-{product.pk}-{i}', f'user-{product.pk}-{i}@example.com', 'password') for i in range(carts)]
+        carts = [Cart.objects.create() for _ in users]
+        for cart in carts:
+            CartItem.objects.create(cart=cart, product=product, quantity=1)
+
+        def checkout(cart, user):
+            serializer = CreateOrderSerializer(data={'cart_id': cart.id}, context={'user_id': user.pk})
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            return 'ordered'
+
+        results = run_concurrently(checkout, list(zip(carts, users)))
+        self.assertFalse([result for result in results if result != 'ordered' and not isinstance(result, ValidationError)])
+        sold = OrderItem.objects.filter(product=product).aggregate(units=Sum('quantity'))['units'] or 0
+        return results.count('ordered'), sold, available_stock([product.pk])[product.pk]
+
+    def test_two_carts_one_unit(self):
+        self.assertEqual(self.checkout_at_once(stock=1, carts=2), (1, 1, 0))
+
+    def test_two_carts_one_unit_sharded(self):
+        self.assertEqual(self.checkout_at_once(stock=1, carts=2, shards=2), (1, 1, 0))
+
+    def test_many_carts(self):
+        for shards in [0, 4]:
+            with self.subTest(shards=shards):
+                self.assertEqual(self.checkout_at_once(stock=15, carts=40, shards=shards), (15, 15, 0))
+
+
+@override_settings(STORE_EVENTS_BACKEND='sync')
+class OrderEventTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        category = Category.objects.create(title='Phones')
+        cls.product = Product.objects.create(title='Phone', description='A phone', price=5000, category=category, stock=1)
+
+    def setUp(self):
+        self.handled = []
+        handlers = mock.patch.dict(events.HANDLERS, {OrderEvent.ORDER_PLACED: [self.handle]}, clear=True)
+        handlers.start()
+        self.addCleanup(handlers.stop)
+        self.client.force_authenticate(self.user)
+
+    def handle(self, event):
+        self.handled.append(event.order_id)
+
+    def checkout(self, quantity=1):
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product=self.product, quantity=quantity)
+        return self.client.post('/store/orders/', {'cart_id': str(cart.id)}, format='json')
+
+    def test_event_is_written_and_handled_with_the_order(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.checkout()
+        self.assertEqual(response.status_code, 200)
+        event = OrderEvent.objects.get()
+        self.assertEqual(event.order_id, response.data['id'])
+        self.assertEqual(event.payload['total'], '5000.00')
+        # the sync backend ran the handler right after the commit
+        self.assertEqual(self.handled, [event.order_id])
+        self.assertEqual(event.attempts, 1)
+        self.assertIsNotNone(event.processed_at)
+
+    def test_event_rolls_back_with_the_order(self):
+        def publish_then_fail(*args, **kwargs):
+            events.publish(*args, **kwargs)
+            raise RuntimeError('checkout failed after publishing')
+
+        with mock.patch('store.serializers.publish', publish_then_fail), self.assertLogs('django.request', 'ERROR'):
+            with self.assertRaises(RuntimeError):
+                self.checkout()
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderEvent.objects.exists())
+
+    def test_rejected_checkout_writes_no_event(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.checkout(quantity=2)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(OrderEvent.objects.exists())
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self.handled, [])
+
+    def test_failing_handler_is_retried_until_max_attempts(self):
+        self.handle = mock.Mock(side_effect=RuntimeError('mail server down'))
+        events.HANDLERS[OrderEvent.ORDER_PLACED] = [self.handle]
+        with self.assertLogs('store.events', 'ERROR') as logs:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(self.checkout().status_code, 200)
+            for _ in range(events.MAX_ATTEMPTS + 2):
+                events.drain_order_events()
+        event = OrderEvent.objects.get()
+        self.assertEqual(event.attempts, events.MAX_ATTEMPTS)
+        self.assertEqual(self.handle.call_count, events.MAX_ATTEMPTS)
+        self.assertEqual(len(logs.output), events.MAX_ATTEMPTS)
+        self.assertIsNone(event.processed_at)
+        self.assertIn('RuntimeError: mail server down', event.last_error)
+        self.assertEqual(events.process_batch(), 0)  # given up on, no longer claimed
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs row locks, SQLite has one writer at a time')
+class ConcurrentOrderEventTests(TransactionTestCase):
+    def test_locked_events_are_skipped(self):
+        user = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        customer = Customer.objects.get(user=user)
+        OrderEvent.objects.bulk_create(
+            OrderEvent(order=Order.objects.create(customer=customer), event_type=OrderEvent.ORDER_PLACED) for _ in range(10)
+        )
+        ids = list(OrderEvent.objects.order_by('id').values_list('id', flat=True))
+        handled = []
+
+        def drain():
+            with connection.cursor() as cursor:
+                cursor.execute("SET lock_timeout = '2s'")  # waiting on the locked rows would be the bug, don't hang on it
+            return events.process_batch(10)
+
+        with mock.patch.dict(events.HANDLERS, {OrderEvent.ORDER_PLACED: [lambda event: handled.append(event.pk)]}, clear=True):
+            with transaction.atomic():
+                list(OrderEvent.objects.select_for_update().filter(id__in=ids[:5]))  # another worker's batch
+                results = run_concurrently(drain, [()])
+        self.assertEqual(results, [5])
+        self.assertEqual(sorted(handled), ids[5:])
+        self.assertEqual(list(OrderEvent.objects.filter(processed_at__isnull=True).order_by('id').values_list('id', flat=True)), ids[:5])
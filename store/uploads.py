@@ -0,0 +1,89 @@
+from django.core.files.uploadhandler import StopUpload, TemporaryFileUploadHandler
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from .validators import MAX_IMAGE_SIZE_KB
+
+
+# Upload handling for product images. Django would buffer the whole body before validate_file_size sees file.size,
+# and FileExtensionValidator only reads the filename. This handler checks both while the body streams in:
+# the request is refused before any of it is read when Content-Length is already too big, otherwise as soon as
+# the running byte count passes the limit or the first bytes aren't a PNG/JPEG signature. Accepted chunks go
+# straight to a temporary file, which FileSystemStorage then moves into place, so an upload never sits in memory.
+# The handler can't raise API errors itself (middleware reading request.POST later would re-run it), so it stops
+# the upload, keeps the error on `self.error` and the view raises it with check_upload().
+SIGNATURES = {
+    b'\x89PNG\r\n\x1a\n': 'image/png',
+    b'\xff\xd8\xff': 'image/jpeg',
+}
+SNIFF_LENGTH = max(len(signature) for signature in SIGNATURES)
+MULTIPART_OVERHEAD = 8 * 1024  # boundaries, part headers and small form fields around the file
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Upload is too large.'
+    default_code = 'upload_too_large'
+
+
+def sniff_image_type(header):
+    for signature, content_type in SIGNATURES.items():
+        if header.startswith(signature):
+            return content_type
+    return None
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    chunk_size = 16 * 1024
+
+    def __init__(self, request=None, max_size=MAX_IMAGE_SIZE_KB * 1024):
+        super().__init__(request)
+        self.max_size = max_size
+        self.error = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length > self.max_size + MULTIPART_OVERHEAD:
+            self.error = UploadTooLarge(f'Upload is larger than {self.max_size // 1024}KB.')
+            return QueryDict(), MultiValueDict()  # parsed as empty, without reading the body
+        return None  # go on parsing as usual
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.header = b''
+        self.sniffed = False
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.max_size:
+            self.abort(UploadTooLarge(f'{self.file_name} is larger than {self.max_size // 1024}KB.'))
+        if not self.sniffed:
+            self.header += raw_data[:SNIFF_LENGTH - len(self.header)]
+            if len(self.header) == SNIFF_LENGTH:
+                self.sniff()
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        if not self.sniffed:
+            self.sniff()  # files shorter than the longest signature
+        return super().file_complete(file_size)
+
+    def sniff(self):
+        content_type = sniff_image_type(self.header)
+        if content_type is None:
+            self.abort(ValidationError({self.field_name: [f'{self.file_name} is not a PNG or JPEG image.']}))
+        self.file.content_type = content_type  # what the bytes are, not what the client claimed
+        self.sniffed = True
+
+    def abort(self, error):
+        # connection_reset: the rest of the body is left unread instead of being drained
+        self.error = error
+        raise StopUpload(connection_reset=True)
+
+
+def check_upload(request):
+    # parses the body (if it wasn't already) and raises whatever the upload handlers refused it for
+    request.data
+    for handler in request.upload_handlers:
+        if getattr(handler, 'error', None) is not None:
+            raise handler.error
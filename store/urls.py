@@ -5,7 +5,7 @@ from rest_framework_nested import routers  # This is for the nested routers
 from store.models import Product
 # from pprint import pprint
 
-from . import views
+from . import async_views, views
 
 
 # This is for the nested routers
@@ -48,6 +48,12 @@ urlpatterns = [
     # path('category/', views.category_list),
     path('category/<int:pk>/', views.CategoryDetail.as_view()),
 
+    ### THIS IS FOR THE ASYNC READ VIEWS (store/async_views.py, served best under ASGI)
+    path('async/products/', async_views.product_list),
+    path('async/products/<int:pk>/', async_views.product_detail),
+    path('async/products/<int:product_pk>/reviews/', async_views.review_list),
+    path('async/category/', async_views.category_list),
+
     ### THIS IS FOR THE FUNCTION BASED VIEWS
     # path('products/', views.product_list),
     # path('products/<int:pk>/', views.product_detail),
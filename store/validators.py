@@ -1,6 +1,8 @@
 from django.core.exceptions import ValidationError
 
+MAX_IMAGE_SIZE_KB = 50  # product images, also enforced while the upload streams in (store/uploads.py)
+
 def validate_file_size(file):
-    max_size_kb = 50
+    max_size_kb = MAX_IMAGE_SIZE_KB
     if file.size > max_size_kb * 1024:
-        raise ValidationError('Your file is greater than 50KB')
\ No newline at end of file
+        raise ValidationError(f'Your file is greater than {max_size_kb}KB')
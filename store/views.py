@@ -10,7 +10,7 @@ from .filters import ProductFilter # This is from the filter  generic filtering
 from rest_framework.filters import SearchFilter  # This is for the search  generic filtering
 from rest_framework.filters import SearchFilter, OrderingFilter  # This is the sorting generic filtering
 from rest_framework.pagination import PageNumberPagination  # This is for pagination
-from .pagination import DefaultPagination, ProductPagination  # This is for custom pagination
+from .pagination import DefaultPagination, ProductPagination, ProductCursorPagination, ReviewPagination, OrderPagination, CustomerPagination  # This is for custom pagination
 from rest_framework import status  # This is for the HTTP status code 
 from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, UpdateModelMixin
 from rest_framework.validators import ValidationError  # This is to raise a validation error
@@ -18,20 +18,33 @@ from .models import Category, Product, Promotion, Review, Cart, CartItem, Custom
 from .serializers import *
 # from .serializers import CategorySerializer, ProductSerializer, ReviewSerializer, CartSerializer, CartItemSerializer, AddCartItemSerializer
 from store import serializers
-from django.db.models import Count, Value  # This is for the annotation 
+from django.db.models import Value  # This is for the annotation 
+from django.db.models import DecimalField, ExpressionWrapper, F, Prefetch, Sum
+from django.db.models.functions import Coalesce
+from django.http import Http404
+from django.conf import settings
+from django.core.cache import cache
+from decimal import Decimal
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny, IsAuthenticatedOrReadOnly, DjangoModelPermissions
 from rest_framework.decorators import action
 from . permissions import IsAdminOrReadOnly, FullDjangoModelPermissions
+from .querysets import optimize_queryset  # This shapes the queryset to what the serializer renders
+from .caching import CatalogueCacheMixin, catalogue_cache_stats, customer_cache_key, shared_cache  # This is the read-through cache for the catalogue
+from .conditional import ConditionalGetMixin, CatalogueConditionalGetMixin  # This answers If-None-Match / If-Modified-Since with 304
+from .readonly import ValuesListMixin, ProductValuesSerializer, OrderValuesSerializer  # This is the read-only list path
+from .uploads import ImageUploadHandler, check_upload  # This streams product image uploads to disk with early size/type checks
+from .search import ProductSearchFilter  # This is the full text search (tsvector on PostgreSQL, FTS5 on SQLite)
 #type:ignore
 
 
 # Create your views here.
 
 # Using viewset
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(CatalogueConditionalGetMixin, CatalogueCacheMixin, ValuesListMixin, ModelViewSet):
     serializer_class = ProductSerializer
     queryset = Product.objects.all()
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    # filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, OrderingFilter]
     # filterset_fields = ['category_id', 'price']  # This is just with the normal filter which uses equals to
     filterset_class = ProductFilter  # This is when you have added from the filter file
     # This is for the search filter
@@ -39,6 +52,8 @@ class ProductViewSet(ModelViewSet):
     ordering_fields = ['price', 'when_uploaded'] 
     pagination_class = PageNumberPagination 
     pagination_class = ProductPagination
+    cache_query_params = ['pagination']
+    values_serializer_classes = {'list': ProductValuesSerializer}  # lists are built from .values() rows, see store/readonly.py
     # permission_classes = [IsAdminUser]
     # permission_classes = [IsAuthenticated]
     # permission_classes = [IsAuthenticated, IsAdminUser]
@@ -58,8 +73,32 @@ class ProductViewSet(ModelViewSet):
         if cat_id:  #or if cat_id is not none:, They are the same
             queryset = Product.objects.filter(category_id=self.request.query_params.get('category_id'))     # type: ignore
         # return Product.objects.filter(category_id=)
+        if self.action == 'retrieve':  # lists are .values() rows (ProductValuesSerializer) and fetch their own images
+            queryset = optimize_queryset(queryset, self.get_serializer_class())  # the images in the same round trip as the product
         return queryset
 
+    def get_serializer_context(self):
+        # lists link the small 'card' image variant, the product page the 'full' one (see store/images.py)
+        context = super().get_serializer_context()
+        context['image_variant'] = 'full' if self.detail else 'card'
+        return context
+
+    @property
+    def paginator(self):
+        # ?pagination=cursor (and the next links it hands out) switches from page numbers to keyset pagination,
+        # so deep pages cost the same as the first one. Add &approximate_count=true for an X-Approximate-Count header.
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if params.get('pagination') == 'cursor' or ProductCursorPagination.cursor_query_param in params:
+                self._paginator = ProductCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    @action(detail=False, methods=['GET'], permission_classes=[IsAdminUser])
+    def cache_stats(self, request):
+        return Response(catalogue_cache_stats())
+
     def destroy_queryset(self, request, pk):
         product = get_object_or_404(Product, pk=pk)
         if product.pk == 1:
@@ -71,6 +110,16 @@ class ProductImageViewSet(ModelViewSet):
     serializer_class = ProductImageSerializer
     # queryset = ProductImage.objects.all()
 
+    def initialize_request(self, request, *args, **kwargs):
+        # size limit and PNG/JPEG check applied while the upload streams in, see store/uploads.py
+        request.upload_handlers = [ImageUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)  # authenticated and allowed before the body is read
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            check_upload(request)
+
     def get_serializer_context(self):
         return {'prod_id': self.kwargs['product_pk']}
         
@@ -81,6 +130,7 @@ class CustomerViewSet(ModelViewSet):
 # class CustomerViewSet(CreateModelMixin,RetrieveModelMixin,UpdateModelMixin,GenericViewSet):
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
+    pagination_class = CustomerPagination  # keyset over the indexed (first_name, last_name, id)
     # permission_classes = [IsAdminUser]
 
     def get_permissions(self):
@@ -92,11 +142,18 @@ class CustomerViewSet(ModelViewSet):
     @action(detail=False, methods=['GET', 'PUT'], permission_classes=[IsAuthenticated])
     def me(self, request):
         # (customer, created) = Customer.objects.get_or_create(user__id=request.user.id)
-        customer = Customer.objects.get(user__id=request.user.id)
+        # customer = Customer.objects.get(user__id=request.user.id)
         if request.method == 'GET':
-            serializer = CustomerSerializer(customer)
-            return Response(serializer.data)
+            if not shared_cache():  # a per-process cache would miss the invalidations made by other workers
+                return Response(CustomerSerializer(get_object_or_404(Customer, user_id=request.user.id)).data)
+            key = customer_cache_key(request.user.id)
+            data = cache.get(key)
+            if data is None:
+                data = CustomerSerializer(get_object_or_404(Customer, user_id=request.user.id)).data
+                cache.set(key, data, getattr(settings, 'STORE_CUSTOMER_CACHE_TIMEOUT', 60 * 15))
+            return Response(data)
         elif request.method == 'PUT':
+            customer = get_object_or_404(Customer, user_id=request.user.id)
             serializer = CustomerSerializer(customer, data=request.data)
             if serializer.is_valid():
                 serializer.save()
@@ -222,8 +279,9 @@ class CustomerViewSet(ModelViewSet):
 #         product.delete()
 #         return Response(status=status.HTTP_204_NO_CONTENT)
 
-class CategoryList(ListCreateAPIView):
-    queryset = Category.objects.annotate(product_count=Count('product'))
+class CategoryList(ConditionalGetMixin, ListCreateAPIView):
+    # queryset = Category.objects.annotate(product_count=Count('product'))
+    queryset = Category.objects.all()  # product_count is a stored column now, no GROUP BY over the products
     serializer_class = CategorySerializer
 
 # @api_view()
@@ -232,7 +290,7 @@ class CategoryList(ListCreateAPIView):
 #     serializer = CategorySerializer(category, many=True)
 #     return Response(serializer.data)
 
-class CategoryDetail(RetrieveUpdateDestroyAPIView):
+class CategoryDetail(ConditionalGetMixin, RetrieveUpdateDestroyAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer   
          
@@ -246,18 +304,58 @@ class CategoryDetail(RetrieveUpdateDestroyAPIView):
 
 
 
-class ReviewViewSet(ModelViewSet):
+class ReviewViewSet(ConditionalGetMixin, ModelViewSet):
     # queryset = Review.objects.filter(product_pk=pk)
     serializer_class = ReviewSerializer
+    pagination_class = ReviewPagination  # keyset over (posted_at, id), deep pages cost the same as the first
+    last_modified_fields = ['last_updated', 'product__last_updated']  # every review embeds its product
+
     def get_queryset(self):
         return Review.objects.filter(product_id=self.kwargs['product_pk']).all()
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['product_id'] = self.kwargs['product_pk']
+        if self.action in ['list', 'retrieve']:
+            # The parent product is fetched and serialized once per read instead of once per review. Writes return
+            # a single review and serialize its product themselves; an unknown product just has no reviews.
+            if not hasattr(self, '_product_data'):
+                product = optimize_queryset(Product.objects.all(), ProductSerializer).filter(pk=self.kwargs['product_pk']).first()
+                self._product_data = None if product is None else ProductSerializer(product, context={'request': self.request, 'image_variant': 'card'}).data
+            if self._product_data is not None:
+                context['product'] = self._product_data
+        return context
+
+
+
+# quantity * price worked out by the database, for a single line and summed over a whole cart
+LINE_TOTAL = ExpressionWrapper(F('quantity') * F('product__price'), output_field=DecimalField(max_digits=12, decimal_places=2))
+CART_TOTAL = Coalesce(
+    Sum(F('cartitem__quantity') * F('cartitem__product__price'), output_field=DecimalField(max_digits=12, decimal_places=2)),
+    Value(Decimal(0)),
+    output_field=DecimalField(max_digits=12, decimal_places=2),
+)
 
 
 class CartViewSet(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
-    queryset = Cart.objects.prefetch_related('cartitem_set__product').all()
+    # queryset = Cart.objects.prefetch_related('cartitem_set__product').all()
     serializer_class = CartSerializer
 
+    def get_queryset(self):
+        items = optimize_queryset(CartItem.objects.annotate(line_total=LINE_TOTAL), CartItemSerializer, include=['cart'])
+        return Cart.objects.annotate(grand_total=CART_TOTAL).prefetch_related(Prefetch('cartitem_set', queryset=items))
+
+    @action(detail=True, methods=['GET'])
+    def summary(self, request, pk=None):
+        # For the cart widget: item count and total in one aggregate query, no line is serialized
+        summary = Cart.objects.filter(pk=pk).annotate(
+            item_count=Coalesce(Sum('cartitem__quantity'), 0),
+            grand_total=CART_TOTAL,
+        ).values('id', 'item_count', 'grand_total').first()
+        if summary is None:
+            raise Http404
+        return Response(summary)
+
 
 class CartItemViewSet(ModelViewSet):
     http_method_names = ["get", "post", "patch", "delete"]
@@ -266,6 +364,8 @@ class CartItemViewSet(ModelViewSet):
         return CartItem.objects.select_related('product').filter(cart_id= self.kwargs['cart_pk'])
     
     def get_serializer_class(self):
+        if self.action == 'bulk':
+            return BulkCartItemSerializer
         if self.request.method == 'POST':
             return AddCartItemSerializer
         elif self.request.method == 'PATCH':
@@ -275,9 +375,20 @@ class CartItemViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {'cart_id':self.kwargs['cart_pk'],'myname':'folorunso'}
 
+    @action(detail=False, methods=['POST'])
+    def bulk(self, request, cart_pk=None):
+        # POST carts/{cart_pk}/items/bulk/ with [{"product_id": .., "quantity": ..}, ...]
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        cart = get_object_or_404(optimize_queryset(Cart.objects.all(), CartSerializer), pk=cart_pk)  # it may be checked out already
+        return Response(CartSerializer(cart).data)
+
 
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(ValuesListMixin, ModelViewSet):
     http_method_names = ['post', 'get', 'patch', 'delete']
+    pagination_class = OrderPagination  # newest first, keyset over (placed_at, id)
+    values_serializer_classes = {'list': OrderValuesSerializer}
     # queryset = Order.objects.all()
     # serializer_class = OrderSerializer
     # permission_classes = [IsAuthenticated]
@@ -286,6 +397,7 @@ class OrderViewSet(ModelViewSet):
         serializer = CreateOrderSerializer(data=request.data, context={'user_id': request.user.id})
         serializer.is_valid(raise_exception=True)
         order = serializer.save()
+        order = optimize_queryset(Order.objects.all(), OrderSerializer).get(pk=order.pk)  # reload with the items prefetched
         serializer = OrderSerializer(order)
         return Response(serializer.data)
 
@@ -316,6 +428,10 @@ class OrderViewSet(ModelViewSet):
 
     def get_queryset(self):
         if self.request.user.is_staff:
-            return Order.objects.all()
-        return Order.objects.filter(customer__user_id= self.request.user.id)
+            queryset = Order.objects.all()
+        else:
+            queryset = Order.objects.filter(customer__user_id= self.request.user.id)
+        if self.action == 'retrieve':  # lists are .values() rows, see OrderValuesSerializer
+            queryset = optimize_queryset(queryset, OrderSerializer)  # items, their products & categories in one prefetch
+        return queryset
     
\ No newline at end of file